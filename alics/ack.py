@@ -3,6 +3,8 @@
 import json
 import argparse
 import aksk
+import inventory
+import retry
 import acsv2
 
 from alibabacloud_cs20151215.client import Client as CS20151215Client
@@ -12,35 +14,32 @@ from alibabacloud_cs20151215 import models as cs20151215_models
 
 def describe_clusters(config: open_api_models.Config):
     req = cs20151215_models.DescribeClustersRequest()
-    res = CS20151215Client(config).describe_clusters(req)
+    res = retry.wrap("ack", CS20151215Client(config)).describe_clusters(req)
     return res.to_map()["body"]
 
 
+def get_cluster_id(config: open_api_models.Config, cluster_name):
+    cluster = inventory.find_one("ack", inventory.config_scope(config), lambda: describe_clusters(config), name=cluster_name)
+    return cluster["cluster_id"] if cluster else None
+
+
 def describe_cluster_detail(config: open_api_models.Config, cluster_id, cluster_name):
     if not cluster_id:
-        res = describe_clusters(config)
-        for cluster in res:
-            if cluster["name"] == cluster_name:
-                cluster_id = cluster["cluster_id"]
-                break
-    res = CS20151215Client(config).describe_cluster_detail(cluster_id)
+        cluster_id = get_cluster_id(config, cluster_name)
+    res = retry.wrap("ack", CS20151215Client(config)).describe_cluster_detail(cluster_id)
     return res.to_map()["body"]
 
 
 def describe_cluster_resources(config: open_api_models.Config, cluster_id, cluster_name):
     if not cluster_id:
-        res = describe_clusters(config)
-        for cluster in res:
-            if cluster["name"] == cluster_name:
-                cluster_id = cluster["cluster_id"]
-                break
-    res = CS20151215Client(config).describe_cluster_resources(cluster_id)
+        cluster_id = get_cluster_id(config, cluster_name)
+    res = retry.wrap("ack", CS20151215Client(config)).describe_cluster_resources(cluster_id)
     return res.to_map()["body"]
 
 
 def describe_cluster_user_kubeconfig(config: open_api_models.Config, cluster_id):
     req = cs20151215_models.DescribeClusterUserKubeconfigRequest()
-    res = CS20151215Client(config).describe_cluster_user_kubeconfig(cluster_id, req)
+    res = retry.wrap("ack", CS20151215Client(config)).describe_cluster_user_kubeconfig(cluster_id, req)
     return res.to_map()["body"]
 
 
@@ -54,7 +53,9 @@ def add_master_to_slb(config: open_api_models.Config, region_id, cluster_id, clu
         if resource["resource_type"] == "ALIYUN::ECS::InstanceGroup":
             ecs_instance_ids.append(resource["instance_id"])
 
-    create_load_balancer_tcp_listener_res = acsv2.do(config, region_id, "slb", "CreateLoadBalancerTCPListener", {
+    # 三个请求有先后依赖，共用一个 slb 客户端顺序执行
+    return acsv2.do_batch(config, region_id, "slb", [{
+        "Action": "CreateLoadBalancerTCPListener",
         "ListenerPort": 6443,
         "BackendServerPort": 6443,
         "Bandwidth": -1,
@@ -64,8 +65,8 @@ def add_master_to_slb(config: open_api_models.Config, region_id, cluster_id, clu
         "AclType": "white",
         "AclStatus": "on",
         "Description": cluster_name
-    })
-    add_backend_servers_res = acsv2.do(config, region_id,  "slb", "AddBackendServers", {
+    }, {
+        "Action": "AddBackendServers",
         "LoadBalancerId": slb_id,
         "BackendServers": json.dumps([{
             "ServerId": x,
@@ -74,12 +75,11 @@ def add_master_to_slb(config: open_api_models.Config, region_id, cluster_id, clu
             "Port": "80",
             "Description": "k8s-master-{}".format(resources[0]["cluster_id"]),
         } for x in ecs_instance_ids])
-    })
-    set_load_balancer_status_res = acsv2.do(config, region_id, "slb", "SetLoadBalancerStatus", {
+    }, {
+        "Action": "SetLoadBalancerStatus",
         "LoadBalancerId": slb_id,
         "LoadBalancerStatus": "active",
-    })
-    return [create_load_balancer_tcp_listener_res, add_backend_servers_res, set_load_balancer_status_res]
+    }])
 
 
 def main():
@@ -103,7 +103,10 @@ def main():
     parser.add_argument("--cluster-name", help="cluster name")
     parser.add_argument("--slb-id", help="slb id")
     parser.add_argument("--acl-id", help="acl id")
+    parser.add_argument("--inventory", default="~/.alics/inventory.db", help="local resource index for name lookups, disabled if empty")
+    parser.add_argument("--inventory-ttl", type=int, default=600, help="resync resource index after seconds")
     args = parser.parse_args()
+    inventory.configure(filename=args.inventory, ttl=args.inventory_ttl)
     if args.credential:
         args.access_key_id, args.access_key_secret = aksk.load_from_file(args.credential)
     config = open_api_models.Config(
@@ -3,6 +3,7 @@
 import argparse
 import json
 import sys
+import retry
 
 from aliyunsdkcore.client import AcsClient
 from aliyunsdkcore.request import CommonRequest
@@ -57,7 +58,7 @@ def do(client: AcsClient, endpoint, disable_https, method, product_id, action, r
         req.set_action_name(request["Action"])
     for key in request:
         req.add_query_param(key, request[key])
-    res = client.do_action_with_exception(req)
+    res = retry.call(product_id or req.get_domain(), client.do_action_with_exception, req)
     return json.loads(str(res, encoding = 'utf-8'))
 
 
@@ -128,7 +129,11 @@ def main():
     parser.add_argument("--request", type=str, help="request json body. read from file if start with @; read from stdin if none")
     parser.add_argument("--method", choices=["GET", "POST"], default="GET", help="method")
     parser.add_argument("--disable-https", nargs="?", const=True, default=False, type=str2bool, help="disable https")
+    parser.add_argument("--retry", type=int, default=3, help="retry times for network errors, throttling and service unavailable")
+    parser.add_argument("--rate-limit", type=float, default=0, help="max requests per second, no limit if 0")
+    parser.add_argument("--retry-metrics", nargs="?", const=True, default=False, type=str2bool, help="print retry metrics to stderr")
     args = parser.parse_args()
+    retry.configure(retry=args.retry)
     client = AcsClient(args.access_key_id, args.access_key_secret, args.region_id)
     if not args.endpoint:
         args.endpoint = "{}.{}.aliyuncs.com".format(args.product_id, args.region_id)
@@ -138,8 +143,11 @@ def main():
         request = json.load(open(args.request[1:]))
     else:
         request = json.loads(args.request)
+    retry.set_rate_limit(args.product_id or args.endpoint, args.rate_limit)
 
     print(json.dumps(do(client, args.endpoint, args.disable_https, args.method, args.product_id, args.action, request)))
+    if args.retry_metrics:
+        sys.stderr.write(json.dumps(retry.stat()) + "\n")
 
 
 if __name__ == '__main__':
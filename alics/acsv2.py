@@ -1,8 +1,13 @@
 #!/usr/bin/env python3
 
 import argparse
+import importlib
 import json
 import re
+import sys
+import threading
+import retry
+from concurrent.futures import ThreadPoolExecutor
 
 from alibabacloud_tea_openapi import models as open_api_models
 
@@ -19,10 +24,47 @@ product_info = {
 }
 
 
+def str2bool(v):
+    if isinstance(v, bool):
+        return v
+    if v.lower() in ('yes', 'true', 't', 'y', '1'):
+        return True
+    elif v.lower() in ('no', 'false', 'f', 'n', '0'):
+        return False
+    else:
+        raise argparse.ArgumentTypeError('Boolean value expected.')
+
+
 def snake_case(name):
     return re.sub("([A-Z]+[a-z0-9]+)", r"\1_", name).lower()[:-1]
 
 
+# 客户端按 (product, endpoint, region, 凭证) 缓存，请求模型和方法名按 (product, action) 缓存
+clients = {}
+handles = {}
+cache_lock = threading.Lock()
+
+
+def get_client(config, product_id):
+    key = (
+        product_id, config.endpoint, config.region_id,
+        config.access_key_id, config.access_key_secret, getattr(config, "security_token", None),
+    )
+    with cache_lock:
+        if key not in clients:
+            clients[key] = importlib.import_module("{}.client".format(product_info[product_id])).Client(config)
+        return clients[key]
+
+
+def get_handle(product_id, action):
+    key = (product_id, action)
+    with cache_lock:
+        if key not in handles:
+            models = importlib.import_module("{}.models".format(product_info[product_id]))
+            handles[key] = (getattr(models, "{}Request".format(action)), snake_case(action))
+        return handles[key]
+
+
 def do(config, region_id, product_id, action, request):
     if "RegionId" not in request:
         request["RegionId"] = region_id
@@ -31,15 +73,20 @@ def do(config, region_id, product_id, action, request):
     if not action:
         action = request["Action"]
 
-    module_name = product_info[product_id]
-    module_client = __import__("{}.client".format(module_name), fromlist=["Client"])
-    module = __import__(product_info[product_id], fromlist=["models"])
+    client = get_client(config, product_id)
+    request_model, method = get_handle(product_id, action)
+    req = request_model().from_map(request)
+    res = retry.call(product_id, getattr(client, method), req)
+    return res.to_map()["body"]
 
-    client = getattr(module_client, "Client")(config)
 
-    req = getattr(getattr(module, "models"), "{}Request".format(action))().from_map(request)
-    res = getattr(client, snake_case(action))(req)
-    return res.to_map()["body"]
+def do_batch(config, region_id, product_id, requests, parallel=1):
+    # requests 中每个请求通过 Action 指定接口，共用同一个客户端，按输入顺序返回结果
+    # parallel 为 1 时顺序执行，适合有先后依赖的请求，任一请求失败时抛出异常
+    if parallel <= 1:
+        return [do(config, region_id, product_id, None, request) for request in requests]
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        return list(executor.map(lambda request: do(config, region_id, product_id, None, request), requests))
 
 
 def main():
@@ -48,6 +95,10 @@ def main():
   python3 acsv2.py -i ak -s sk -e ram.aliyuncs.com -p ram -a GetUser --request '{
     "UserName": "imm-test-hl"
   }'
+  python3 acsv2.py -i ak -s sk -r cn-shanghai -p slb --batch --parallel 4 --request '[
+    {"Action": "DescribeLoadBalancerAttribute", "LoadBalancerId": "lb-xxx"},
+    {"Action": "DescribeLoadBalancerAttribute", "LoadBalancerId": "lb-yyy"}
+  ]'
 """)
     parser.add_argument("-i", "--access-key-id", help="access key id")
     parser.add_argument("-s", "--access-key-secret", help="access key secret")
@@ -56,14 +107,26 @@ def main():
     parser.add_argument("-p", "--product-id", help="product id")
     parser.add_argument("-e", "--endpoint", help="endpoint")
     parser.add_argument("--request", help="request")
+    parser.add_argument("--batch", nargs="?", const=True, default=False, type=str2bool, help="request is a json list, each item specify Action")
+    parser.add_argument("--parallel", type=int, default=1, help="batch mode parallel requests")
+    parser.add_argument("--retry", type=int, default=3, help="retry times for network errors, throttling and service unavailable")
+    parser.add_argument("--rate-limit", type=float, default=0, help="max requests per second, no limit if 0")
+    parser.add_argument("--retry-metrics", nargs="?", const=True, default=False, type=str2bool, help="print retry metrics to stderr")
     args = parser.parse_args()
+    retry.configure(retry=args.retry)
+    retry.set_rate_limit(args.product_id, args.rate_limit)
     config = open_api_models.Config(
         access_key_id=args.access_key_id,
         access_key_secret=args.access_key_secret,
         region_id=args.region_id,
         endpoint=args.endpoint,
     )
-    print(json.dumps(do(config, args.region_id, args.product_id, args.action, json.loads(args.request))))
+    if args.batch:
+        print(json.dumps(do_batch(config, args.region_id, args.product_id, json.loads(args.request), args.parallel)))
+    else:
+        print(json.dumps(do(config, args.region_id, args.product_id, args.action, json.loads(args.request))))
+    if args.retry_metrics:
+        sys.stderr.write(json.dumps(retry.stat()) + "\n")
 
 
 if __name__ == "__main__":
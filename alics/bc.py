@@ -4,6 +4,8 @@ import argparse
 import json
 import uuid
 import aksk
+import inventory
+import retry
 
 from batchcompute import Client
 from batchcompute.resources import AppDescription
@@ -168,6 +170,10 @@ def create_app_wps(client: Client, app_name):
     return create_app(client, app_wps_tpl.format(app_name=app_name))
 
 
+# 本地资源索引的 scope，main 中按 AccessKeyId 和地域设置，为空时按名字查找集群需要列出全部集群
+inventory_scope = None
+
+
 def list_clusters(client: Client):
     marker = ""
     clusters = []
@@ -185,6 +191,8 @@ def get_cluster(client: Client, cluster_id, cluster_name):
     if cluster_id:
         res = client.get_cluster(cluster_id)
         return json.loads(str(res))
+    if inventory_scope:
+        return inventory.find_one("bc", inventory_scope, lambda: list_clusters(client), name=cluster_name)
     res = list_clusters(client)
     for cls in res:
         if cls["Name"] == cluster_name:
@@ -284,10 +292,15 @@ def main():
     parser.add_argument("--vm-count", help="vm count")
     parser.add_argument("--parameters", help="parameters")
     parser.add_argument("--instance-type", default="ecs.sn2.medium", help="instance type")
+    parser.add_argument("--inventory", default="~/.alics/inventory.db", help="local resource index for name lookups, disabled if empty")
+    parser.add_argument("--inventory-ttl", type=int, default=600, help="resync resource index after seconds")
     args = parser.parse_args()
+    inventory.configure(filename=args.inventory, ttl=args.inventory_ttl)
     if args.credential:
         args.access_key_id, args.access_key_secret = aksk.load_from_file(args.credential)
-    client = Client("batchcompute.{}.aliyuncs.com".format(args.region_id), args.access_key_id, args.access_key_secret)
+    global inventory_scope
+    inventory_scope = inventory.scope(args.access_key_id, args.region_id)
+    client = retry.wrap("batchcompute", Client("batchcompute.{}.aliyuncs.com".format(args.region_id), args.access_key_id, args.access_key_secret))
     if args.action == "ListClusters":
         print(json.dumps(list_clusters(client)))
     elif args.action == "GetCluster":
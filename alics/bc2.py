@@ -4,12 +4,18 @@ import argparse
 import json
 import uuid
 import aksk
+import inventory
+import retry
 
 from alibabacloud_batchcompute20181213 import client as bcsc
 from alibabacloud_batchcompute20181213 import models as bcsm
 from alibabacloud_tea_openapi import models as open_api_models
 
 
+# 本地资源索引的 scope，main 中按 AccessKeyId 和地域设置，为空时按名字查找集群需要列出全部集群
+inventory_scope = None
+
+
 def list_clusters(client: bcsc.Client, project):
     marker = ""
     clusters = []
@@ -27,6 +33,8 @@ def get_cluster(client: bcsc.Client, project, cluster_id, cluster_name):
     if cluster_id:
         res = client.get_cluster(bcsm.GetClusterRequest(project=project, cluster_id=cluster_id)).body
         return res.to_map()
+    if inventory_scope:
+        return inventory.find_one("bc2", inventory.scope(inventory_scope, project), lambda: list_clusters(client, project), name=cluster_name)
     res = list_clusters(client, project)
     for cls in res:
         if cls["Name"] == cluster_name:
@@ -121,18 +129,23 @@ def main():
     parser.add_argument("--image-id", help="image id")
     parser.add_argument("--change", help="change")
     parser.add_argument("--instance-type", default="ecs.sn2.medium", help="instance type")
+    parser.add_argument("--inventory", default="~/.alics/inventory.db", help="local resource index for name lookups, disabled if empty")
+    parser.add_argument("--inventory-ttl", type=int, default=600, help="resync resource index after seconds")
     args = parser.parse_args()
+    inventory.configure(filename=args.inventory, ttl=args.inventory_ttl)
     if args.credential:
         args.access_key_id, args.access_key_secret = aksk.load_from_file(args.credential)
+    global inventory_scope
+    inventory_scope = inventory.scope(args.access_key_id, args.region_id)
 
-    client = bcsc.Client(open_api_models.Config(
+    client = retry.wrap("batchcompute", bcsc.Client(open_api_models.Config(
         access_key_id=args.access_key_id,
         access_key_secret=args.access_key_secret,
         endpoint="{}.{}.batchcompute.aliyuncs.com".format(args.uid, args.region_id),
         region_id=args.region_id,
         protocol="http",
         type="access_key"
-    ))
+    )))
     if args.action == "ListClusters":
         print(json.dumps(list_clusters(client, args.project)))
     elif args.action == "GetCluster":
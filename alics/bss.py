@@ -4,9 +4,10 @@ import argparse
 import json
 import aksk
 import datetime
-import time
+import retry
 
 from aliyunsdkcore.client import AcsClient
+from aliyunsdkcore.acs_exception.exceptions import ServerException
 from aliyunsdkbssopenapi.request.v20171214.QueryBillOverviewRequest import QueryBillOverviewRequest
 from aliyunsdkbssopenapi.request.v20171214.DescribeInstanceBillRequest import DescribeInstanceBillRequest
 
@@ -18,7 +19,7 @@ def query_bill_overview(client, billing_cycle=(datetime.datetime.now() - datetim
     if billing_date:
         req.set_BillingDate(billing_date)
         req.set_Granularity("DAILY")
-    res = client.do_action_with_exception(req)
+    res = retry.call("bss", client.do_action_with_exception, req)
     return json.loads(str(res, encoding='utf-8'))["Data"]["Items"]["Item"]
 
 
@@ -30,24 +31,22 @@ def describe_instance_bill(client, billing_cycle=(datetime.datetime.now() - date
     if billing_date:
         req.set_BillingDate(billing_date)
         req.set_Granularity("DAILY")
-    retry_times = 0
+    # 返回中没有 Data 时按服务端临时错误重试，翻页请求限速每秒 2 次
+    retry.set_rate_limit("bss", 2)
     items = []
     while True:
-        res = client.do_action_with_exception(req)
-        res = json.loads(str(res, encoding='utf-8'))
+        res = retry.call(
+            "bss", lambda: json.loads(str(client.do_action_with_exception(req), encoding='utf-8')),
+            check=lambda res: None if "Data" in res else res.get("Code") or "ServiceUnavailable", action="DescribeInstanceBill",
+        )
+        # 不可重试的错误或者重试次数用完时返回的是错误信息
         if "Data" not in res:
-            if retry_times >= 20:
-                raise
-            time.sleep(2 * retry_times + 5)
-            retry_times += 1
-            continue
+            raise ServerException(res.get("Code") or "ServiceUnavailable", res.get("Message") or json.dumps(res), request_id=res.get("RequestId"))
         for item in res["Data"]["Items"]:
             items.append(item)
         if len(items) >= res["Data"]["TotalCount"]:
             break
         req.set_NextToken(res["Data"]["NextToken"])
-        time.sleep(0.5)
-        retry_times = 0
     return items
 
 
@@ -70,6 +69,8 @@ def main():
     if args.credential:
         args.access_key_id, args.access_key_secret = aksk.load_from_file(args.credential)
     client = AcsClient(args.access_key_id, args.access_key_secret, args.region_id)
+    # 账单接口限流严格，保持原来最多重试 20 次的行为
+    retry.configure(retry=20, cap=45)
     if args.billing_date:
         args.billing_cycle = args.billing_date[:7]
     if args.action == "QueryBillOverview":
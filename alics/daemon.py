@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+
+import argparse
+import array
+import importlib
+import json
+import os
+import select
+import signal
+import socket
+import sys
+import traceback
+
+
+# 常驻进程，预先 import 脚本和 SDK，通过 unix socket 执行脚本，省去每次启动解释器和 import SDK 的时间
+# 客户端把自己的 stdin/stdout/stderr 文件描述符通过 SCM_RIGHTS 传给常驻进程，常驻进程 fork 子进程执行脚本的 main
+# 子进程直接读写客户端的描述符，支持管道和大量输出，结束后把退出码返回给客户端
+# 客户端收到 SIGINT/SIGTERM 时转发给子进程，客户端断开时常驻进程终止子进程
+# 子进程之间互不影响，脚本中的全局状态（缓存、限速）只在一次执行内有效
+# 常驻进程是单线程的，在 select 循环中接收请求、fork 和回收子进程，避免在多线程进程中 fork
+# 客户端只 import 标准库，常驻进程没有启动时直接执行对应的脚本
+
+
+usage = """usage:
+  python3 daemon.py serve [--socket ~/.alics/daemon.sock] [--scripts acs,acsv2,ecs,ots]
+  python3 daemon.py stop [--socket ~/.alics/daemon.sock]
+  python3 daemon.py <script> [script args...]
+  the client uses $ALICS_DAEMON_SOCKET if set
+
+example:
+  nohup python3 daemon.py serve &
+  python3 daemon.py ots -c ~/.aksk/imm-dev -r cn-shanghai -d imm-dev-hl -t IMMConfig -a GetRow --primary-keys '{"Block": "Base", "Section": "Common"}'
+  python3 daemon.py ecs -c ~/.aksk/imm-dev -r cn-shanghai -a DescribeInstances
+  cat IMMConfig.json | python3 daemon.py ots -c ~/.aksk/imm-dev -r cn-shanghai -d imm-dev-hl -t IMMConfig -a PutRow --batch --change
+  ALICS_DAEMON_SOCKET=/tmp/alics.sock python3 daemon.py acs -i ak -s sk -r cn-shanghai -p kms -a ListKeys --request '{}'
+"""
+
+default_socket = os.environ.get("ALICS_DAEMON_SOCKET", "~/.alics/daemon.sock")
+default_scripts = "acs,acsv2,ecs,ots"
+
+
+def send_message(sock, message, fds=None):
+    data = (json.dumps(message) + "\n").encode()
+    if fds:
+        sock.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds))])
+    else:
+        sock.sendall(data)
+
+
+def recv_chunk(sock, maxfds=0):
+    # 文件描述符随第一段数据一起到达
+    fds = array.array("i")
+    data, ancdata, _, _ = sock.recvmsg(65536, socket.CMSG_LEN(maxfds * fds.itemsize) if maxfds else 0)
+    for level, kind, cmsg in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(cmsg[:len(cmsg) - len(cmsg) % fds.itemsize])
+    return data, list(fds)
+
+
+def recv_message(sock, maxfds=0):
+    data, fds = recv_chunk(sock, maxfds)
+    while data and not data.endswith(b"\n"):
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    return (json.loads(data) if data else None), fds
+
+
+def read_message(reader):
+    # 客户端按行读取，一次 recv 可能收到多条消息
+    line = reader.readline()
+    return json.loads(line) if line else None
+
+
+def run_script(module, req, fds):
+    # 在 fork 出的子进程中执行，不返回
+    code = 0
+    try:
+        for i, fd in enumerate(fds):
+            os.dup2(fd, i)
+            os.close(fd)
+        sys.stdin = open(0, closefd=False)
+        sys.stdout = open(1, "w", closefd=False)
+        sys.stderr = open(2, "w", closefd=False)
+        os.chdir(req["Cwd"])
+        os.environ.clear()
+        os.environ.update(req["Env"])
+        sys.argv = [module.__file__] + req["Args"]
+        module.main()
+    except KeyboardInterrupt:
+        code = 128 + signal.SIGINT
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        if not isinstance(e.code, int) and e.code is not None:
+            sys.stderr.write("{}\n".format(e.code))
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+
+def reply(conn, message, close=True):
+    # 客户端可能已经断开，发送失败时忽略，不影响其他请求
+    try:
+        conn.setblocking(True)
+        send_message(conn, message)
+    except OSError:
+        pass
+    if close:
+        conn.close()
+
+
+def read_request(conn, pending):
+    # 非阻塞地读取请求，读完一行时返回 (请求, 描述符)，没有读完时返回 None，客户端断开时关闭连接
+    data, fds = pending[conn]
+    try:
+        chunk, chunk_fds = recv_chunk(conn, 3)
+    except BlockingIOError:
+        return None
+    except OSError:
+        chunk, chunk_fds = b"", []
+    data += chunk
+    fds += chunk_fds
+    pending[conn] = (data, fds)
+    if chunk and not data.endswith(b"\n"):
+        return None
+    del pending[conn]
+    try:
+        req = json.loads(data) if chunk else None
+    except ValueError:
+        req = None
+    if req is None:
+        for fd in fds:
+            os.close(fd)
+        conn.close()
+        return None
+    return req, fds
+
+
+def dispatch(conn, req, fds, modules, server, path, sockets, children, watching):
+    # 在主线程中处理请求并 fork，返回 False 表示停止服务
+    # 常驻进程只有一个线程，fork 时不会有其他线程持有锁，子进程中的 import、日志和 SDK 的锁都处于释放状态
+    if req.get("Stop"):
+        os.remove(path)
+        reply(conn, {"Code": 0})
+        return False
+    if req.get("Script") not in modules or len(fds) != 3:
+        for fd in fds:
+            os.close(fd)
+        reply(conn, {"Unsupported": True})
+        return True
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        # 恢复 SIGCHLD 的默认处理，脚本中的 subprocess 可以正常等待自己的子进程
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        for sock in [server, conn, *sockets, *children.values()]:
+            sock.close()
+        run_script(modules[req["Script"]], req, fds)
+    for fd in fds:
+        os.close(fd)
+    # 把子进程的 pid 发给客户端，客户端收到 SIGINT/SIGTERM 时转发给子进程
+    reply(conn, {"Pid": pid}, close=False)
+    children[pid] = conn
+    watching[conn] = pid
+    return True
+
+
+def watch(conn, watching):
+    # 客户端在子进程结束前断开（被 kill 或者没有转发信号）时终止子进程，避免中断的写操作继续执行
+    try:
+        if conn.recv(4096, socket.MSG_DONTWAIT):
+            return
+    except BlockingIOError:
+        return
+    except OSError:
+        pass
+    try:
+        os.kill(watching.pop(conn), signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+
+
+def reap(children, watching):
+    # 回收所有已经结束的子进程，把退出码返回给对应的客户端
+    while children:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+        conn = children.pop(pid, None)
+        if conn is None:
+            continue
+        watching.pop(conn, None)
+        reply(conn, {"Code": os.WEXITSTATUS(status) if os.WIFEXITED(status) else 128 + os.WTERMSIG(status)})
+
+
+def serve(path, scripts):
+    # 保证 0/1/2 已经打开，收到的描述符不会与之冲突
+    for fd in range(3):
+        try:
+            os.fstat(fd)
+        except OSError:
+            os.open(os.devnull, os.O_RDWR)
+    modules = {}
+    for name in scripts.split(","):
+        try:
+            modules[name] = importlib.import_module(name)
+        except ImportError as e:
+            sys.stderr.write(json.dumps({"Script": name, "Error": str(e)}) + "\n")
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    if os.path.exists(path):
+        os.remove(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o177)
+    try:
+        server.bind(path)
+    finally:
+        os.umask(umask)
+    server.listen(128)
+    sys.stderr.write(json.dumps({"Socket": path, "Scripts": list(modules), "Pid": os.getpid()}) + "\n")
+    sys.stderr.flush()
+    # 子进程结束时 SIGCHLD 写入 wakeup，与 server 和各个连接一起在 select 中等待
+    # 接收请求、fork 和回收子进程都在主线程中，请求非阻塞地读取，慢的客户端不会阻塞其他请求
+    wakeup = socket.socketpair()
+    for sock in wakeup:
+        sock.setblocking(False)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+    signal.set_wakeup_fd(wakeup[1].fileno())
+    pending = {}
+    children = {}
+    watching = {}
+    try:
+        while True:
+            readable, _, _ = select.select([server, wakeup[0], *pending, *watching], [], [])
+            if wakeup[0] in readable:
+                try:
+                    while wakeup[0].recv(4096):
+                        pass
+                except BlockingIOError:
+                    pass
+            reap(children, watching)
+            for conn in readable:
+                if conn in watching:
+                    watch(conn, watching)
+                elif conn in pending:
+                    res = read_request(conn, pending)
+                    if res and not dispatch(conn, *res, modules, server, path, [*wakeup, *pending], children, watching):
+                        return
+            if server in readable:
+                conn, _ = server.accept()
+                conn.setblocking(False)
+                pending[conn] = (b"", [])
+    finally:
+        signal.set_wakeup_fd(-1)
+        server.close()
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def exec_script(script, args):
+    filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), "{}.py".format(script))
+    os.execv(sys.executable, [sys.executable, filename] + args)
+
+
+def forward_signals(pid):
+    # 子进程不在客户端的进程组中，Ctrl-C 和 SIGTERM 由客户端转发，客户端继续等待子进程的退出码
+    def handler(signum, frame):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, handler)
+
+
+def call(path, script, args):
+    # 常驻进程没有启动或者没有加载该脚本时，直接执行脚本
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        exec_script(script, args)
+    with sock, sock.makefile("rb") as reader:
+        sys.stdout.flush()
+        send_message(sock, {"Script": script, "Args": args, "Cwd": os.getcwd(), "Env": dict(os.environ)}, [0, 1, 2])
+        res = read_message(reader)
+        if res and "Pid" in res:
+            forward_signals(res["Pid"])
+            res = read_message(reader)
+    if res is None:
+        sys.stderr.write("daemon closed connection\n")
+        return 1
+    if res.get("Unsupported"):
+        exec_script(script, args)
+    return res["Code"]
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] in ("-h", "--help"):
+        sys.stdout.write(usage)
+        return
+    if sys.argv[1] not in ("serve", "stop"):
+        sys.exit(call(os.path.expanduser(default_socket), sys.argv[1], sys.argv[2:]))
+
+    parser = argparse.ArgumentParser(formatter_class=lambda prog: argparse.RawTextHelpFormatter(prog, width=200), description=usage)
+    parser.add_argument("command", choices=["serve", "stop"])
+    parser.add_argument("--socket", default=default_socket, help="unix socket path")
+    parser.add_argument("--scripts", default=default_scripts, help="scripts to preload and serve, comma separated")
+    args = parser.parse_args()
+    path = os.path.expanduser(args.socket)
+    if args.command == "serve":
+        serve(path, args.scripts)
+    else:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+        with sock:
+            send_message(sock, {"Stop": True})
+            recv_message(sock)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,37 @@
 #!/usr/bin/env python3
 
 import re
+import sys
 import json
 import argparse
+import ipaddress
 import aksk
+import inventory
+import paginate
+import regions
+import retry
 import vpc
+from concurrent.futures import ThreadPoolExecutor
 
 from alibabacloud_ecs20140526.client import Client as Ecs20140526Client
 from alibabacloud_tea_openapi import models as open_api_models
 from alibabacloud_ecs20140526 import models as ecs_20140526_models
 
 
+def str2bool(v):
+    if isinstance(v, bool):
+        return v
+    if v.lower() in ('yes', 'true', 't', 'y', '1'):
+        return True
+    elif v.lower() in ('no', 'false', 'f', 'n', '0'):
+        return False
+    else:
+        raise argparse.ArgumentTypeError('Boolean value expected.')
+
+
 def describe_regions(config: open_api_models.Config):
     req = ecs_20140526_models.DescribeInstancesRequest()
-    res = Ecs20140526Client(config).describe_regions(req)
+    res = retry.wrap("ecs", Ecs20140526Client(config)).describe_regions(req)
     return res.to_map()["body"]["Regions"]["Region"]
 
 
@@ -27,32 +45,29 @@ def describe_instances(config: open_api_models.Config, region_id, instance_id, i
     if vpc_id:
         req.vpc_id = vpc_id
     if not vpc_id and vpc_name:
-        res = vpc.describe_vpcs(config, region_id, vpc_id, vpc_name)
-        req.vpc_id = res[0]["VpcId"]
+        req.vpc_id = vpc.get_vpc_id(config, region_id, vpc_name)
     if public_ip:
         req.public_ip_addresses = json.dumps([public_ip])
     if private_ip:
         req.private_ip_addresses = json.dumps([private_ip])
 
-    instances = []
-    count = 0
-    while True:
-        res = Ecs20140526Client(config).describe_instances(req)
-        res = res.to_map()["body"]
-        for instance in res["Instances"]["Instance"]:
-            instances.append(instance)
-        if len(instances) >= res["TotalCount"] or count >= 100:
-            break
-        count += 1
-        req.page_number = res["PageNumber"] + 1
-    return instances
+    client = retry.wrap("ecs", Ecs20140526Client(config))
+    return paginate.fetch_all(client.describe_instances, req, ["Instances", "Instance"], 100, max_pages=100)
+
+
+def describe_instances_by_ids(config: open_api_models.Config, region_id, instance_ids):
+    # DescribeInstances 的 InstanceIds 最多 100 个，分批查询
+    res = []
+    for i in range(0, len(instance_ids), 100):
+        res.extend(describe_instances(config, region_id, ",".join(instance_ids[i:i + 100]), None, None, None, None, None))
+    return res
 
 
 def describe_price(config: open_api_models.Config, region_id, instance_type):
     req = ecs_20140526_models.DescribePriceRequest()
     req.instance_type = instance_type
     req.region_id = region_id
-    res = Ecs20140526Client(config).describe_price(req)
+    res = retry.wrap("ecs", Ecs20140526Client(config)).describe_price(req)
     return res.to_map()["body"]["PriceInfo"]
 
 
@@ -61,20 +76,10 @@ def describe_security_groups(config: open_api_models.Config, region_id, security
     req.region_id = region_id
     req.vpc_id = vpc_id
     if not vpc_id and vpc_name:
-        res = vpc.describe_vpcs(config, region_id, vpc_id, vpc_name)
-        req.vpc_id = res[0]["VpcId"]
-
-    security_groups = []
-    count = 0
-    while True:
-        res = Ecs20140526Client(config).describe_security_groups(req)
-        res = res.to_map()["body"]
-        for security_group in res["SecurityGroups"]["SecurityGroup"]:
-            security_groups.append(security_group)
-        if len(security_groups) >= res["TotalCount"] or count >= 100:
-            break
-        count += 1
-        req.page_number = res["PageNumber"] + 1
+        req.vpc_id = vpc.get_vpc_id(config, region_id, vpc_name)
+
+    client = retry.wrap("ecs", Ecs20140526Client(config))
+    security_groups = paginate.fetch_all(client.describe_security_groups, req, ["SecurityGroups", "SecurityGroup"], 50, max_pages=100)
     if not security_group_name:
         return security_groups
     pattern = re.compile(".*" + security_group_name + ".*")
@@ -92,7 +97,7 @@ def modify_security_group_rule(config: open_api_models.Config, region_id, securi
     if security_group_name:
         res = describe_security_groups(config, region_id, security_group_name, vpc_id, vpc_name)
         req.security_group_id = res[0]["SecurityGroupId"]
-    res = Ecs20140526Client(config).modify_security_group_rule(req)
+    res = retry.wrap("ecs", Ecs20140526Client(config)).modify_security_group_rule(req)
     return res.to_map()["body"]
 
 
@@ -108,7 +113,7 @@ def authorize_security_group(config: open_api_models.Config, region_id, security
         res = describe_security_groups(config, region_id, security_group_name, vpc_id, vpc_name)
         req.security_group_id = res[0]["SecurityGroupId"]
     req.description = "create by ecs.py"
-    res = Ecs20140526Client(config).authorize_security_group(req)
+    res = retry.wrap("ecs", Ecs20140526Client(config)).authorize_security_group(req)
     return res.to_map()["body"]
 
 
@@ -118,11 +123,10 @@ def create_security_group(config: open_api_models.Config, region_id, security_gr
     if vpc_id:
         req.vpc_id = vpc_id
     if not vpc_id and vpc_name:
-        res = vpc.describe_vpcs(config, region_id, vpc_id, vpc_name)
-        req.vpc_id = res[0]["VpcId"]
+        req.vpc_id = vpc.get_vpc_id(config, region_id, vpc_name)
     req.security_group_name = security_group_name
     req.description = "create by ecs.py"
-    res = Ecs20140526Client(config).create_security_group(req)
+    res = retry.wrap("ecs", Ecs20140526Client(config)).create_security_group(req)
     return res.to_map()["body"]
 
 
@@ -131,16 +135,23 @@ def join_security_group(config: open_api_models.Config, region_id, instance_id,
     req.region_id = region_id
     req.instance_id = instance_id
     req.security_group_id = security_group_id
-    res = Ecs20140526Client(config).join_security_group(req)
+    res = retry.wrap("ecs", Ecs20140526Client(config)).join_security_group(req)
     return res.to_map()["body"]
 
 
 def add_access_control_to_security_group(config: open_api_models.Config, region_id, security_group_name, instance_id, instance_name, vpc_id, vpc_name, cidr_ip, ip_protocol, port_range):
     instance = None
     if instance_id or instance_name:
-        res = describe_instances(config, region_id, instance_id, instance_name, None, vpc_name, None, None)
-        vpc_id = res[0]["VpcAttributes"]["VpcId"]
-        instance = res[0]
+        # 先按 ID 或完整的名字在本地索引中查找，没有找到时按名字模糊查询
+        res = inventory.find(
+            "ecs", inventory.config_scope(config, region_id), lambda: describe_instances(config, region_id, None, None, None, None, None, None),
+            id=instance_id, name=None if instance_id else instance_name, vpc_id=vpc.get_vpc_id(config, region_id, vpc_name) if vpc_name else None,
+        )
+        if not res:
+            res = describe_instances(config, region_id, instance_id, instance_name, None, vpc_name, None, None)
+        # 索引只用来解析名字，实例所在的安全组可能已经变化，决定是否加入安全组前实时查询
+        instance = describe_instances_by_ids(config, region_id, [res[0]["InstanceId"]])[0]
+        vpc_id = instance["VpcAttributes"]["VpcId"]
     res = describe_security_groups(config, region_id, security_group_name, vpc_id, vpc_name)
     if not res:
         res = create_security_group(config, region_id, security_group_name, vpc_id, vpc_name)
@@ -154,6 +165,96 @@ def add_access_control_to_security_group(config: open_api_models.Config, region_
     return res
 
 
+def describe_security_group_attribute(config: open_api_models.Config, region_id, security_group_id):
+    req = ecs_20140526_models.DescribeSecurityGroupAttributeRequest()
+    req.region_id = region_id
+    req.security_group_id = security_group_id
+    req.direction = "ingress"
+    res = retry.wrap("ecs", Ecs20140526Client(config)).describe_security_group_attribute(req)
+    return res.to_map()["body"]
+
+
+def rule_key(ip_protocol, port_range, cidr_ip, policy="accept", priority="1", nic_type="intranet"):
+    # 接口返回的协议和策略大小写不固定，单个 IP 的 CidrIp 可能不带掩码，统一后比较
+    # policy/priority/nic_type 的默认值与 AuthorizeSecurityGroup 不指定时一致，同一网段的 drop 规则或者其他优先级的规则不算已存在
+    return ip_protocol.lower(), port_range, str(ipaddress.ip_network(cidr_ip, strict=False)), policy.lower(), str(priority), nic_type.lower()
+
+
+def batch_add_access_control_to_security_group(
+    config: open_api_models.Config, region_id, security_group_name, instance_ids, instance_names, vpc_id, vpc_name, cidr_ips, ip_protocol, port_ranges, parallel=8,
+):
+    # 把多个 IP 和端口的访问权限加到多个实例所在 VPC 的安全组中，安全组不存在时创建，实例不在安全组中时加入
+    # 每个安全组只查询一次已有规则，在本地比较，只并发添加缺少的规则
+    # 返回每个安全组的结果，有请求失败时命令行的退出码为 1
+    instances = {}
+    if instance_ids or instance_names:
+        scope = inventory.config_scope(config, region_id)
+        fetch = lambda: describe_instances(config, region_id, None, None, None, None, None, None)
+        for instance_id in instance_ids:
+            for instance in inventory.find("ecs", scope, fetch, id=instance_id):
+                instances[instance["InstanceId"]] = instance
+        for instance_name in instance_names:
+            res = inventory.find("ecs", scope, fetch, name=instance_name)
+            if not res:
+                res = describe_instances(config, region_id, None, instance_name, None, vpc_name, None, None)
+            for instance in res:
+                instances[instance["InstanceId"]] = instance
+        # 索引只用来解析名字，实例所在的安全组可能已经变化，决定是否加入安全组前实时查询
+        instances = {x["InstanceId"]: x for x in describe_instances_by_ids(config, region_id, list(instances))}
+
+    # 按 VPC 分组，没有指定实例时使用 --vpc-id/--vpc-name
+    vpcs = {}
+    for instance in instances.values():
+        vpcs.setdefault(instance["VpcAttributes"]["VpcId"], []).append(instance)
+    if not vpcs:
+        vpcs[vpc_id or vpc.get_vpc_id(config, region_id, vpc_name)] = []
+
+    rules = list({rule_key(*x): x for x in [(ip_protocol, port_range, cidr_ip) for cidr_ip in cidr_ips for port_range in port_ranges]}.values())
+    groups = []
+    tasks = []
+    for vid, vpc_instances in vpcs.items():
+        res = describe_security_groups(config, region_id, security_group_name, vid, None)
+        created = not res
+        security_group_id = create_security_group(config, region_id, security_group_name, vid, None)["SecurityGroupId"] if created else res[0]["SecurityGroupId"]
+        existing = set()
+        if not created:
+            for permission in describe_security_group_attribute(config, region_id, security_group_id)["Permissions"]["Permission"]:
+                if permission.get("SourceCidrIp"):
+                    existing.add(rule_key(
+                        permission["IpProtocol"], permission["PortRange"], permission["SourceCidrIp"],
+                        permission.get("Policy") or "accept", permission.get("Priority") or "1", permission.get("NicType") or "intranet",
+                    ))
+        missing = [rule for rule in rules if rule_key(*rule) not in existing]
+        joins = [x["InstanceId"] for x in vpc_instances if security_group_id not in x["SecurityGroupIds"]["SecurityGroupId"]]
+        group = {
+            "SecurityGroupId": security_group_id, "VpcId": vid, "Created": created,
+            "Authorized": [], "Existing": len(rules) - len(missing), "Joined": [], "Failed": [],
+        }
+        groups.append(group)
+        for protocol, port_range, cidr_ip in missing:
+            tasks.append((group, "Authorized", {"IpProtocol": protocol, "PortRange": port_range, "CidrIp": cidr_ip}, authorize_security_group,
+                          config, region_id, security_group_id, None, vid, None, cidr_ip, protocol, port_range))
+        for instance_id in joins:
+            tasks.append((group, "Joined", instance_id, join_security_group, config, region_id, instance_id, security_group_id))
+
+    # 每个任务单独记录结果，某个请求失败不影响其他请求，失败的请求和错误信息记录在 Failed 中
+    def run(task):
+        try:
+            task[3](*task[4:])
+            return None
+        except Exception as e:
+            return str(e)
+
+    if tasks:
+        with ThreadPoolExecutor(max_workers=min(parallel, len(tasks))) as executor:
+            for (group, field, item, *_), err in zip(tasks, executor.map(run, tasks)):
+                if err is None:
+                    group[field].append(item)
+                else:
+                    group["Failed"].append({field: item, "Error": err})
+    return groups
+
+
 def main():
     parser = argparse.ArgumentParser(formatter_class=lambda prog: argparse.RawTextHelpFormatter(prog, width=200), description="""example:
   python3 ecs.py -c ~/.aksk/imm-dev -r cn-shanghai -a DescribeRegions
@@ -161,9 +262,13 @@ def main():
   python3 ecs.py -c ~/.aksk/imm-dev -r cn-shanghai -a DescribeInstances --instance-name hl | jq ".[].InstanceType" | sort | uniq -c
   python3 ecs.py -c ~/.aksk/imm-dev -r cn-shanghai -a DescribeInstances --public-ip 47.116.74.14 | jq ".[].InstanceType" | sort | uniq -c
   python3 ecs.py -c ~/.aksk/imm-dev -r cn-shanghai -a DescribeInstances --instance-name hl | jq -r '.[] | "\(.InstanceType) \(.CpuOptions.CoreCount) \(.CpuOptions.ThreadsPerCore) \(.Memory)M"'
+  python3 ecs.py -c ~/.aksk/imm-dev -r cn-shanghai -a DescribeInstances --all-regions | jq -r '.[] | "\(.RegionId) \(.InstanceId)"'
+  python3 ecs.py -c ~/.aksk/imm-dev -r cn-shanghai -a DescribeInstances --all-regions --changes | jq -c '{Event, Id, Changed}'
   python3 ecs.py -c ~/.aksk/imm-dev -r cn-shanghai -a DescribeSecurityGroups --vpc-name imm-dev-hl-vpc-shanghai-ecs --security-group-name imm-dev-hl-security-group
   python3 ecs.py -c ~/.aksk/imm-dev -r cn-shanghai -a AddAccessControlToSecurityGroup --vpc-name imm-dev-hl-vpc-shanghai-ecs --security-group-name imm-dev-hl-security-group --ip "$(wget -qO - icanhazip.com)"
   python3 ecs.py -c ~/.aksk/imm-dev -r cn-shanghai -a AddAccessControlToSecurityGroup --instance-name imm-dev-hl-ecs --security-group-name imm-dev-hl-security-group --ip "$(wget -qO - icanhazip.com)"
+  python3 ecs.py -c ~/.aksk/imm-dev -r cn-shanghai -a BatchAddAccessControlToSecurityGroup --instance-name imm-dev-hl-ecs-1,imm-dev-hl-ecs-2 \\
+    --security-group-name imm-dev-hl-security-group --ip 47.116.74.14,10.0.0.0/8 --ip-protocol tcp --port-range 22/22,80/80,443/443
 """)
     parser.add_argument("-i", "--access-key-id", help="access key id")
     parser.add_argument("-s", "--access-key-secret", help="access key secret")
@@ -171,7 +276,7 @@ def main():
     parser.add_argument("-r", "--region-id", help="region id")
     parser.add_argument("-a", "--action", help="action", choices=[
         "DescribeRegions", "DescribeInstances", "DescribePrice", "DescribeSecurityGroups",
-        "AddAccessControlToSecurityGroup"
+        "AddAccessControlToSecurityGroup", "BatchAddAccessControlToSecurityGroup"
     ])
     parser.add_argument("--instance-name", help="instance name")
     parser.add_argument("--instance-type", help="instance type")
@@ -184,7 +289,14 @@ def main():
     parser.add_argument("--ip-protocol", default="all", help="ip protocol")
     parser.add_argument("--public-ip", help="public ip")
     parser.add_argument("--private-ip", help="private ip")
+    parser.add_argument("--all-regions", nargs="?", const=True, default=False, type=str2bool, help="describe in all regions concurrently, region id is set in each result")
+    parser.add_argument("--region-parallel", type=int, default=8, help="max regions described concurrently")
+    parser.add_argument("--changes", nargs="?", const=True, default=False, type=str2bool, help="print added/removed/modified resources since last run as ndjson")
+    parser.add_argument("--parallel", type=int, default=8, help="BatchAddAccessControlToSecurityGroup parallel requests, --ip/--port-range/--instance-id/--instance-name are comma separated")
+    parser.add_argument("--inventory", default="~/.alics/inventory.db", help="local resource index for name lookups, disabled if empty")
+    parser.add_argument("--inventory-ttl", type=int, default=600, help="resync resource index after seconds")
     args = parser.parse_args()
+    inventory.configure(filename=args.inventory, ttl=args.inventory_ttl)
     if args.credential:
         args.access_key_id, args.access_key_secret = aksk.load_from_file(args.credential)
     config = open_api_models.Config(
@@ -193,18 +305,42 @@ def main():
         region_id=args.region_id,
     )
 
+    if args.action in ("AddAccessControlToSecurityGroup", "BatchAddAccessControlToSecurityGroup") and not args.ip:
+        parser.error("--ip is required for {}".format(args.action))
+    if args.action == "BatchAddAccessControlToSecurityGroup" and not args.port_range:
+        parser.error("--port-range is required for {}".format(args.action))
+
     if args.action == "DescribeRegions":
         print(json.dumps(describe_regions(config)))
     elif args.action == "DescribeInstances":
-        print(json.dumps(describe_instances(config, args.region_id, args.instance_id, args.instance_name, args.vpc_id, args.vpc_name, args.public_ip, args.private_ip)))
+        regions.print_describe(
+            config, args.region_id, "ecs", describe_instances, args.instance_id, args.instance_name, args.vpc_id, args.vpc_name, args.public_ip, args.private_ip,
+            all_regions=args.all_regions, changes=args.changes, parallel=args.region_parallel, filters={
+                "InstanceId": args.instance_id, "InstanceName": args.instance_name, "VpcId": args.vpc_id, "VpcName": args.vpc_name,
+                "PublicIp": args.public_ip, "PrivateIp": args.private_ip,
+            },
+        )
     elif args.action == "DescribePrice":
         print(json.dumps(describe_price(config, args.region_id, args.instance_type)))
     elif args.action == "DescribeSecurityGroups":
-        print(json.dumps(describe_security_groups(config, args.region_id, args.security_group_name, args.vpc_id, args.vpc_name)))
+        regions.print_describe(
+            config, args.region_id, "security_group", describe_security_groups, args.security_group_name, args.vpc_id, args.vpc_name,
+            all_regions=args.all_regions, changes=args.changes, parallel=args.region_parallel,
+            filters={"SecurityGroupName": args.security_group_name, "VpcId": args.vpc_id, "VpcName": args.vpc_name},
+        )
     elif args.action == "AddAccessControlToSecurityGroup":
         print(json.dumps(add_access_control_to_security_group(
             config, args.region_id, args.security_group_name, args.instance_id, args.instance_name, args.vpc_id, args.vpc_name, args.ip, args.ip_protocol, args.port_range
         )))
+    elif args.action == "BatchAddAccessControlToSecurityGroup":
+        res = batch_add_access_control_to_security_group(
+            config, args.region_id, args.security_group_name,
+            args.instance_id.split(",") if args.instance_id else [], args.instance_name.split(",") if args.instance_name else [],
+            args.vpc_id, args.vpc_name, args.ip.split(","), args.ip_protocol, args.port_range.split(","), args.parallel,
+        )
+        print(json.dumps(res))
+        if any(group["Failed"] for group in res):
+            sys.exit(1)
     else:
         parser.print_help()
 
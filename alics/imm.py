@@ -1,59 +1,10 @@
 #!/usr/bin/env python3
 
 import argparse
-import base64
-import datetime
-import hmac
 import json
-import random
 import urllib
-import requests
 import aksk
-
-
-def encode(message):
-    return urllib.parse.quote(str(message), safe='', encoding="utf-8").replace("+", "%20").replace("*", "%2A").replace("%7E", "~")
-
-
-def signature(methods, params, access_key_secret):
-    kvs = "&".join([
-        "{}={}".format(encode(i), encode(params[i])) for i in sorted(params)
-    ])
-    to_sign = methods + "&" + encode("/") + "&" + "" + encode(kvs)
-    return base64.b64encode(hmac.new((access_key_secret + '&').encode(), to_sign.encode(), digestmod='sha1').digest()).decode()
-
-
-def make_pop_params(methods, params, access_key_id, access_key_secret):
-    params["AccessKeyId"] = access_key_id
-    if "Format" not in params:
-        params["Format"] = "JSON"
-    if "Version" not in params:
-        params["Version"] = "2017-09-06"
-    if "Timestamp" not in params:
-        params["Timestamp"] = datetime.datetime.utcnow().isoformat()
-    if "SignatureMethod" not in params:
-        params["SignatureMethod"] = "HMAC-SHA1"
-    if "SignatureVersion" not in params:
-        params["SignatureVersion"] = "1.0"
-    if "SignatureNonce" not in params:
-        params["SignatureNonce"] = random.randint(0, 2**63-1)
-    params["Signature"] = signature(methods, params, access_key_secret)
-    return params
-
-
-def assume_role(endpoint, access_key_id, access_key_secret, owner_id, role):
-    # https://help.aliyun.com/document_detail/28763.html?spm=a2c4g.11186623.6.805.78927ffb2YnPpi
-    params = {
-        "Action": "AssumeRole",
-        "Version": "2015-04-01",
-        "RoleArn": "acs:ram::{}:role/{}".format(owner_id, role),
-        "RoleSessionName": "test",
-        "DurationSeconds": 3600,
-    }
-    params = make_pop_params("POST", params, access_key_id, access_key_secret)
-
-    res = requests.post(endpoint, params=params)
-    return json.loads(res.text)
+import popclient
 
 
 def preview(endpoint, params, access_key_id, access_key_secret, security_token):
@@ -62,18 +13,10 @@ def preview(endpoint, params, access_key_id, access_key_secret, security_token):
     params["accessKeySecret"] = access_key_secret
     if security_token:
         params["stsToken"] = urllib.parse.quote(security_token)
-    res = requests.get(endpoint, params=params)
+    res = popclient.get_session().get(endpoint, params=params, timeout=popclient.timeout())
     return json.loads(json.dumps(urllib.parse.unquote(res.url)))
 
 
-def do(endpoint, params, access_key_id, access_key_secret, security_token):
-    if security_token:
-        params["SecurityToken"] = security_token
-    params = make_pop_params("POST", params, access_key_id, access_key_secret)
-    res = requests.post(endpoint, params=params)
-    return json.loads(res.text)
-
-
 def main():
     parser = argparse.ArgumentParser(formatter_class=lambda prog: argparse.RawTextHelpFormatter(prog, width=200), description="""example:
   python3 imm.py -c ~/.aksk/imm-test -i ak -s sk -r cn-shanghai --request '{
@@ -101,8 +44,13 @@ def main():
     parser.add_argument("-r", "--region-id", help="region")
     parser.add_argument("--role", help="role")
     parser.add_argument("--owner-id", help="user id")
+    parser.add_argument("--sts-cache", default="~/.alics/sts.json", help="assume role credential cache file, disable cache if empty")
     parser.add_argument("--request", help="request")
+    parser.add_argument("--pool-size", type=int, default=10, help="http connection pool size")
+    parser.add_argument("--connect-timeout", type=float, default=5, help="http connect timeout in seconds")
+    parser.add_argument("--read-timeout", type=float, default=60, help="http read timeout in seconds")
     args = parser.parse_args()
+    popclient.configure(args.pool_size, args.connect_timeout, args.read_timeout)
 
     if args.credential:
         args.access_key_id, args.access_key_secret = aksk.load_from_file(args.credential)
@@ -111,7 +59,9 @@ def main():
 
     security_token = ''
     if args.owner_id and args.role:
-        res = assume_role("https://sts.aliyuncs.com", args.access_key_id, args.access_key_secret, args.owner_id, args.role)
+        res = popclient.cached_assume_role(
+            "https://sts.aliyuncs.com", args.access_key_id, args.access_key_secret, args.owner_id, args.role, args.sts_cache
+        )
         args.access_key_id = res["Credentials"]["AccessKeyId"]
         args.access_key_secret = res["Credentials"]["AccessKeySecret"]
         security_token = res["Credentials"]["SecurityToken"]
@@ -121,7 +71,7 @@ def main():
         del(request["Action"])
         preview("https://preview.imm.aliyuncs.com/index.html", request, args.access_key_id, args.access_key_secret, security_token)
     else:
-        print(json.dumps(do(args.endpoint, request, args.access_key_id, args.access_key_secret, security_token)))
+        print(json.dumps(popclient.do(args.endpoint, request, args.access_key_id, args.access_key_secret, security_token)))
 
 
 if __name__ == "__main__":
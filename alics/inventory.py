@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import sqlite3
+import sys
+import time
+
+
+# 本地 SQLite 资源索引，按名字、ID、VPC 和 IP 查找资源，省去每次按名字查找时列出全部资源
+# 资源按 (kind, scope) 整体同步，scope 一般为 "AccessKeyId/RegionId"，同步时间超过 ttl 或者索引中没有找到时调用接口重新同步
+# filename 为空时不落盘，每次查找都调用接口，结果与不使用索引一致
+# refresh 把新的资源列表与索引中的快照按内容比较，只写入有变化的资源，返回新增、删除和修改的事件
+
+
+options = {
+    "filename": "~/.alics/inventory.db",
+    "ttl": 600,
+}
+
+
+def ips(*values):
+    res = []
+    for value in values:
+        if isinstance(value, dict):
+            value = value.get("IpAddress", [])
+        if isinstance(value, list):
+            res.extend(value)
+        elif value:
+            res.append(value)
+    return res
+
+
+# 每类资源提取 (id, name, vpc_id, ips)
+kinds = {
+    "ecs": lambda x: (x["InstanceId"], x.get("InstanceName"), x.get("VpcAttributes", {}).get("VpcId"), ips(
+        x.get("PublicIpAddress"), x.get("InnerIpAddress"), x.get("EipAddress"), x.get("VpcAttributes", {}).get("PrivateIpAddress"),
+    )),
+    "security_group": lambda x: (x["SecurityGroupId"], x.get("SecurityGroupName"), x.get("VpcId"), []),
+    "vpc": lambda x: (x["VpcId"], x.get("VpcName"), x["VpcId"], []),
+    "vswitch": lambda x: (x["VSwitchId"], x.get("VSwitchName"), x.get("VpcId"), []),
+    "slb": lambda x: (x["LoadBalancerId"], x.get("LoadBalancerName"), x.get("VpcId"), ips(x.get("Address"))),
+    "slb_acl": lambda x: (x["AclId"], x.get("AclName"), None, []),
+    "redis": lambda x: (x["InstanceId"], x.get("InstanceName"), x.get("VpcId"), ips(x.get("PrivateIp"))),
+    "rds": lambda x: (x["DBInstanceId"], x.get("DBInstanceDescription"), x.get("VpcId"), []),
+    "ack": lambda x: (x["cluster_id"], x.get("name"), x.get("vpc_id"), []),
+    "bc": lambda x: (x["Id"], x.get("Name"), None, []),
+    "bc2": lambda x: (x["ClusterId"], x.get("Name"), None, []),
+}
+
+
+def configure(filename=None, ttl=None):
+    for key, val in (("filename", filename), ("ttl", ttl)):
+        if val is not None:
+            options[key] = val
+
+
+def scope(*parts):
+    return "/".join(str(x) for x in parts)
+
+
+def config_scope(config, region_id=None):
+    return scope(config.access_key_id, region_id or config.region_id)
+
+
+def changes_scope(base, **filters):
+    # 变化输出的快照与按名字查找的索引分开保存，查找时的重新同步不会吞掉两次输出之间的变化
+    # 带过滤条件的列表单独保存快照，避免过滤掉的资源被当成删除
+    return "{}#changes?{}".format(base, "&".join("{}={}".format(k, v) for k, v in sorted(filters.items()) if v))
+
+
+def connect():
+    filename = ":memory:"
+    if options["filename"]:
+        filename = os.path.expanduser(options["filename"])
+        os.makedirs(os.path.dirname(filename) or ".", mode=0o700, exist_ok=True)
+    conn = sqlite3.connect(filename, timeout=30)
+    with conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS resources (kind TEXT, scope TEXT, id TEXT, name TEXT, vpc_id TEXT, data TEXT, PRIMARY KEY (kind, scope, id))")
+        conn.execute("CREATE INDEX IF NOT EXISTS resources_name ON resources (kind, scope, name)")
+        conn.execute("CREATE INDEX IF NOT EXISTS resources_vpc_id ON resources (kind, scope, vpc_id)")
+        conn.execute("CREATE TABLE IF NOT EXISTS addresses (kind TEXT, scope TEXT, ip TEXT, id TEXT, PRIMARY KEY (kind, scope, ip, id))")
+        conn.execute("CREATE TABLE IF NOT EXISTS syncs (kind TEXT, scope TEXT, synced_at REAL, PRIMARY KEY (kind, scope))")
+    return conn
+
+
+def canonical(item):
+    return json.dumps(item, sort_keys=True)
+
+
+def put(conn, kind, scope, item):
+    id_, name, vpc_id, addresses = kinds[kind](item)
+    conn.execute("INSERT OR REPLACE INTO resources VALUES (?, ?, ?, ?, ?, ?)", (kind, scope, id_, name, vpc_id, canonical(item)))
+    conn.execute("DELETE FROM addresses WHERE kind = ? AND scope = ? AND id = ?", (kind, scope, id_))
+    conn.executemany("INSERT OR IGNORE INTO addresses VALUES (?, ?, ?, ?)", [(kind, scope, ip, id_) for ip in addresses])
+
+
+def sync(conn, kind, scope, items):
+    # 在一个事务中替换 (kind, scope) 下的所有资源
+    with conn:
+        conn.execute("DELETE FROM resources WHERE kind = ? AND scope = ?", (kind, scope))
+        conn.execute("DELETE FROM addresses WHERE kind = ? AND scope = ?", (kind, scope))
+        for item in items:
+            put(conn, kind, scope, item)
+        conn.execute("INSERT OR REPLACE INTO syncs VALUES (?, ?, ?)", (kind, scope, time.time()))
+
+
+def synced_at(conn, kind, scope):
+    row = conn.execute("SELECT synced_at FROM syncs WHERE kind = ? AND scope = ?", (kind, scope)).fetchone()
+    return row[0] if row else 0
+
+
+def query(conn, kind, scope, id=None, name=None, vpc_id=None, ip=None):
+    sql = "SELECT data FROM resources WHERE kind = ? AND scope = ?"
+    params = [kind, scope]
+    for column, value in (("id", id), ("name", name), ("vpc_id", vpc_id)):
+        if value:
+            sql += " AND {} = ?".format(column)
+            params.append(value)
+    if ip:
+        sql += " AND id IN (SELECT id FROM addresses WHERE kind = ? AND scope = ? AND ip = ?)"
+        params.extend([kind, scope, ip])
+    return [json.loads(row[0]) for row in conn.execute(sql, params)]
+
+
+def find(kind, scope, fetch, ttl=None, **where):
+    # fetch 返回 scope 下的全部资源，where 为 id/name/vpc_id/ip 的精确匹配条件
+    # 索引在 ttl 内且找到时直接返回，否则调用 fetch 重新同步后再查找
+    # 所有条件都为空时（如名字未指定）不匹配任何资源，返回空列表，而不是 scope 下的全部资源
+    if not any(where.values()):
+        return []
+    ttl = options["ttl"] if ttl is None else ttl
+    conn = connect()
+    try:
+        if options["filename"] and ttl > 0 and time.time() - synced_at(conn, kind, scope) < ttl:
+            res = query(conn, kind, scope, **where)
+            if res:
+                return res
+        sync(conn, kind, scope, fetch())
+        return query(conn, kind, scope, **where)
+    finally:
+        conn.close()
+
+
+def find_one(kind, scope, fetch, ttl=None, **where):
+    res = find(kind, scope, fetch, ttl=ttl, **where)
+    return res[0] if res else None
+
+
+def refresh(kind, scope, items):
+    # 与上一次的快照比较，返回 Added/Removed/Modified 事件，Modified 带有变化的字段名
+    # 快照按规范化的 json 比较，只有变化的资源写入索引，第一次执行时所有资源都是 Added
+    events = []
+    conn = connect()
+    try:
+        with conn:
+            snapshot = {row[0]: row[1] for row in conn.execute("SELECT id, data FROM resources WHERE kind = ? AND scope = ?", (kind, scope))}
+            seen = set()
+            for item in items:
+                id_, name = kinds[kind](item)[:2]
+                seen.add(id_)
+                old = snapshot.get(id_)
+                if old == canonical(item):
+                    continue
+                event = {"Event": "Added" if old is None else "Modified", "Kind": kind, "Id": id_, "Name": name, "Data": item}
+                if old is not None:
+                    old = json.loads(old)
+                    event["Changed"] = sorted(k for k in set(old) | set(item) if old.get(k) != item.get(k))
+                events.append(event)
+                put(conn, kind, scope, item)
+            for id_ in snapshot:
+                if id_ in seen:
+                    continue
+                old = json.loads(snapshot[id_])
+                events.append({"Event": "Removed", "Kind": kind, "Id": id_, "Name": kinds[kind](old)[1], "Data": old})
+                conn.execute("DELETE FROM resources WHERE kind = ? AND scope = ? AND id = ?", (kind, scope, id_))
+                conn.execute("DELETE FROM addresses WHERE kind = ? AND scope = ? AND id = ?", (kind, scope, id_))
+            conn.execute("INSERT OR REPLACE INTO syncs VALUES (?, ?, ?)", (kind, scope, time.time()))
+    finally:
+        conn.close()
+    return events
+
+
+def print_changes(kind, scope, items):
+    for event in refresh(kind, scope, items):
+        sys.stdout.write(json.dumps(event) + "\n")
@@ -2,13 +2,16 @@
 
 import argparse
 import json
+import threading
 import aksk
+import retry
 
 from aliyunsdkcore.client import AcsClient
 from aliyunsdkkms.request.v20160120.ListKeysRequest import ListKeysRequest
 from aliyunsdkkms.request.v20160120.EncryptRequest import EncryptRequest
 from aliyunsdkkms.request.v20160120.DecryptRequest import DecryptRequest
 from aliyunsdkkms.request.v20160120.GenerateDataKeyRequest import GenerateDataKeyRequest
+from concurrent.futures import Future
 
 
 def encrypt(client, key_id, text):
@@ -16,20 +19,42 @@ def encrypt(client, key_id, text):
     req.set_accept_format('json')
     req.set_KeyId(key_id)
     req.set_Plaintext(text)
-    res = client.do_action_with_exception(req)
+    res = retry.call("kms", client.do_action_with_exception, req)
     return json.loads(res)
 
 
 def decrypt(client, text):
     req = DecryptRequest()
     req.set_CiphertextBlob(text)
-    res = client.do_action_with_exception(req)
+    res = retry.call("kms", client.do_action_with_exception, req)
     return json.loads(res)
 
 
+# 进程内解密结果缓存，key 为密文
+decrypt_memo = {}
+decrypt_memo_lock = threading.Lock()
+
+
+def memo_decrypt(client, text):
+    # 多个线程同时解密同一个密文时，只有一个线程真正调用 kms
+    with decrypt_memo_lock:
+        future = decrypt_memo.get(text)
+        owner = future is None
+        if owner:
+            future = decrypt_memo[text] = Future()
+    if owner:
+        try:
+            future.set_result(decrypt(client, text))
+        except Exception as e:
+            future.set_exception(e)
+            with decrypt_memo_lock:
+                del decrypt_memo[text]
+    return future.result()
+
+
 def list_keys(client):
     req = ListKeysRequest()
-    res = client.do_action_with_exception(req)
+    res = retry.call("kms", client.do_action_with_exception, req)
     return json.loads(res)
 
 
@@ -37,7 +62,7 @@ def generate_data_key(client, key_id):
     req = GenerateDataKeyRequest()
     req.set_accept_format('json')
     req.set_KeyId(key_id)
-    res = client.do_action_with_exception(req)
+    res = retry.call("kms", client.do_action_with_exception, req)
     return json.loads(res)
 
 
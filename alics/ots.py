@@ -1,15 +1,28 @@
 #!/usr/bin/env python3
 
 import argparse
+import collections
+import contextlib
+import functools
+import hashlib
+import hmac
 import json
+import os
+import queue
+import random
+import struct
 import sys
+import threading
+import time
 import fnv
 import tablestore
 import base64
+import zlib
 import aksk
 import diff
 import kms
 from aliyunsdkcore.client import AcsClient
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 
 def list_table(client):
@@ -37,38 +50,460 @@ def describe_table(client, table):
     }
 
 
-def get_range(client, table):
-    meta = client.describe_table(table)
-    keys = [v[0] for v in meta.table_meta.schema_of_primary_key]
+# 表结构缓存，key 为 "instance/table"，file 非空时同时持久化到磁盘
+schema_cache = {
+    "file": "",
+    "ttl": 3600,
+    "tables": {},
+}
+schema_cache_lock = threading.Lock()
 
+
+def instance_name(client):
+    return getattr(getattr(client, "protocol", client), "instance_name", "")
+
+
+def load_schema_cache(filename, ttl):
+    schema_cache["file"] = filename
+    schema_cache["ttl"] = ttl
+    if filename and os.path.exists(filename):
+        with open(filename) as fp:
+            schema_cache["tables"] = json.load(fp)
+
+
+def save_schema_cache():
+    if not schema_cache["file"]:
+        return
+    tmp = "{}.{}.tmp".format(schema_cache["file"], os.getpid())
+    with open(tmp, "w") as fp:
+        json.dump(schema_cache["tables"], fp)
+    os.replace(tmp, schema_cache["file"])
+
+
+def invalidate_schema_cache(client, table=None):
+    prefix = "{}/".format(instance_name(client))
+    with schema_cache_lock:
+        for key in list(schema_cache["tables"]):
+            if key == prefix + (table or "") or (not table and key.startswith(prefix)):
+                del schema_cache["tables"][key]
+        save_schema_cache()
+
+
+def table_schema(client, table):
+    key = "{}/{}".format(instance_name(client), table)
+    with schema_cache_lock:
+        item = schema_cache["tables"].get(key)
+        if item and time.time() - item["time"] < schema_cache["ttl"]:
+            return item["schema"]
+        meta = client.describe_table(table)
+        schema = [[v[0], v[1]] for v in meta.table_meta.schema_of_primary_key]
+        schema_cache["tables"][key] = {"schema": schema, "time": time.time()}
+        save_schema_cache()
+        return schema
+
+
+def table_keys(client, table):
+    return [v[0] for v in table_schema(client, table)]
+
+
+def row_to_dict(row):
+    pkmap = {}
+    colmap = {}
+    for pk in row.primary_key:
+        pkmap[pk[0]] = pk[1]
+    for col in row.attribute_columns:
+        colmap[col[0]] = col[1]
+    return {
+        "PrimaryKeys": pkmap,
+        "Columns": colmap,
+    }
+
+
+comparators = {
+    "==": "EQUAL", "!=": "NOT_EQUAL", ">": "GREATER_THAN", ">=": "GREATER_EQUAL", "<": "LESS_THAN", "<=": "LESS_EQUAL",
+}
+
+
+def make_column_filter(spec):
+    # 单列条件: {"Column": "Enable", "Comparator": "==", "Value": true, "PassIfMissing": false}
+    # 组合条件: {"Operator": "AND", "Conditions": [...]}，Operator 取值 AND/OR/NOT
+    if spec is None:
+        return None
+    if "Conditions" in spec:
+        cond = tablestore.CompositeColumnCondition(getattr(tablestore.LogicalOperator, spec.get("Operator", "AND").upper()))
+        for sub in spec["Conditions"]:
+            cond.add_sub_condition(make_column_filter(sub))
+        return cond
+    comparator = comparators.get(spec.get("Comparator", "=="), spec.get("Comparator", "==")).upper()
+    return tablestore.SingleColumnCondition(
+        spec["Column"], spec["Value"], getattr(tablestore.ComparatorType, comparator),
+        pass_if_missing=spec.get("PassIfMissing", False),
+    )
+
+
+def filter_columns(spec):
+    if spec is None:
+        return []
+    if "Conditions" in spec:
+        return [col for sub in spec["Conditions"] for col in filter_columns(sub)]
+    return [spec["Column"]]
+
+
+def make_range_bounds(keys, start=None, end=None):
+    # start/end 为主键的前缀，缺失的主键列都补 INF_MIN，end 不包含，{"Block": "Basf"} 不会包含 Block 为 Basf 的行
+    # 没有 end 时扫描到表尾，所有主键列为 INF_MAX
+    start = start or {}
     start_primary_keys = []
     end_primary_keys = []
-
     for key in keys:
-        start_primary_keys.append((key, tablestore.INF_MIN))
-        end_primary_keys.append((key, tablestore.INF_MAX))
+        start_primary_keys.append((key, start.get(key, tablestore.INF_MIN)))
+        end_primary_keys.append((key, end.get(key, tablestore.INF_MIN) if end else tablestore.INF_MAX))
+    return start_primary_keys, end_primary_keys
+
+
+def compare_primary_keys(pks1, pks2):
+    infs = (tablestore.INF_MIN, tablestore.INF_MAX)
+    for (_, v1), (_, v2) in zip(pks1, pks2):
+        if v1 is v2 or (v1 not in infs and v2 not in infs and v1 == v2):
+            continue
+        if v1 is tablestore.INF_MIN or v2 is tablestore.INF_MAX:
+            return -1
+        if v1 is tablestore.INF_MAX or v2 is tablestore.INF_MIN:
+            return 1
+        return -1 if v1 < v2 else 1
+    return 0
+
 
-    all_rows = []
+def iter_range_with_next(client, table, start_primary_keys, end_primary_keys, columns_to_get=None, column_filter=None):
+    # 逐页转换并返回，同时返回下一页的起始主键，内存中最多只保留一页数据
     while start_primary_keys is not None:
         _, start_primary_keys, rows, _ = client.get_range(
             table, tablestore.Direction.FORWARD,
-            start_primary_keys, end_primary_keys, []
+            start_primary_keys, end_primary_keys, columns_to_get or [],
+            column_filter=column_filter, max_version=1
         )
-        all_rows.extend(rows)
-
-    res = []
-    for row in all_rows:
-        pkmap = {}
-        colmap = {}
-        for pk in row.primary_key:
-            pkmap[pk[0]] = pk[1]
-        for col in row.attribute_columns:
-            colmap[col[0]] = col[1]
-        res.append({
-            "PrimaryKeys": pkmap,
-            "Columns": colmap,
-        })
-    return res
+        yield [row_to_dict(row) for row in rows], start_primary_keys
+
+
+def iter_range(client, table, start_primary_keys, end_primary_keys, columns_to_get=None, column_filter=None):
+    for page, _ in iter_range_with_next(client, table, start_primary_keys, end_primary_keys, columns_to_get, column_filter):
+        yield page
+
+
+def get_range(client, table, columns_to_get=None, column_filter=None, start=None, end=None):
+    keys = table_keys(client, table)
+    start_primary_keys, end_primary_keys = make_range_bounds(keys, start, end)
+    for page in iter_range(client, table, start_primary_keys, end_primary_keys, columns_to_get, column_filter):
+        yield from page
+
+
+def midpoint(a, b):
+    # 返回 a < mid < b 的值，用于在观察到的主键之间二分，没有时返回 None
+    # STRING/BINARY 按字符（字节）序列看作大数求平均，字符串按码点比较与服务端按 UTF-8 字节比较的顺序一致
+    if isinstance(a, bool) or type(a) is not type(b):
+        return None
+    if isinstance(a, int):
+        mid = (a + b) // 2
+    elif isinstance(a, (str, bytes, bytearray)):
+        binary = not isinstance(a, str)
+        base = 257 if binary else 0x110001
+        da = [(x if binary else ord(x)) + 1 for x in a]
+        db = [(x if binary else ord(x)) + 1 for x in b]
+        n = max(len(da), len(db)) + 1
+        total = 0
+        for x, y in zip(da + [0] * (n - len(da)), db + [0] * (n - len(db))):
+            total = total * base + x + y
+        total //= 2
+        digits = []
+        for _ in range(n):
+            total, d = divmod(total, base)
+            digits.append(d)
+        digits.reverse()
+        while digits and digits[-1] == 0:
+            digits.pop()
+        vals = [max(d - 1, 0) for d in digits]
+        mid = bytes(vals) if binary else "".join(chr(0xE000 if 0xD800 <= v < 0xE000 else v) for v in vals)
+    else:
+        return None
+    return mid if a < mid < b else None
+
+
+def midpoint_primary_keys(lo, hi):
+    # 在第一个不同的主键列上取中间值，之后的列补 INF_MIN
+    for i, ((key, v1), (_, v2)) in enumerate(zip(lo, hi)):
+        if v1 is v2 or (not isinstance(v1, type) and not isinstance(v2, type) and v1 == v2):
+            continue
+        if isinstance(v1, type) or isinstance(v2, type):
+            return None
+        mid = midpoint(v1, v2)
+        if mid is None:
+            return None
+        return lo[:i] + [(key, mid)] + [(k, tablestore.INF_MIN) for k, _ in lo[i + 1:]]
+    return None
+
+
+def probe_primary_key(client, table, start_primary_keys, end_primary_keys, direction=tablestore.Direction.FORWARD):
+    # 返回区间内第一行（BACKWARD 时为最后一行）的主键，没有数据时返回 None
+    _, _, rows, _ = client.get_range(table, direction, start_primary_keys, end_primary_keys, [], limit=1, max_version=1)
+    return list(rows[0].primary_key) if rows else None
+
+
+def compute_split_ranges(client, table, schema, shards=32, start=None, end=None, parallel=8):
+    # 返回 [start, end) 区间列表，覆盖 start/end 之间的范围（默认整张表）
+    # SDK（5.x/6.x）没有 ComputeSplitPointsBySize，切分点从数据中获取：先取区间内第一行和最后一行的主键，
+    # 再在观察到的主键之间逐层二分，每个中间值用 limit=1 的 GetRange 找到其后的第一行作为切分点，
+    # 中间值之后没有数据时逆序找到其前的最后一行，收缩区间，这样数据集中在某个前缀时也会继续在后面的主键列上二分
+    # 二分按主键值而不是行数，分片大小不保证均匀，但切分点都落在实际的数据上，公共前缀很长的主键（如 OwnerId 前缀）也能切开
+    # 所有分片都找不到切分点时（空表、只有一行、主键类型不支持）退化为一个区间，即串行扫描
+    keys = [v[0] for v in schema]
+    start_primary_keys, end_primary_keys = make_range_bounds(keys, start, end)
+    first = probe_primary_key(client, table, start_primary_keys, end_primary_keys)
+    last = probe_primary_key(client, table, end_primary_keys, start_primary_keys, tablestore.Direction.BACKWARD) if first else None
+    points = []
+    intervals = [(first, last)] if first and last and compare_primary_keys(first, last) < 0 else []
+
+    def split(interval):
+        lo, hi = interval
+        mid = midpoint_primary_keys(lo, hi)
+        if mid is None:
+            return None, []
+        point = probe_primary_key(client, table, mid, hi)
+        if point is None or compare_primary_keys(point, hi) >= 0:
+            # [mid, hi) 中没有数据，区间收缩到 mid 之前的最后一行，保证区间的两端都是实际的主键
+            last = probe_primary_key(client, table, mid, lo, tablestore.Direction.BACKWARD)
+            return None, [(lo, last)] if last and compare_primary_keys(lo, last) < 0 else []
+        return point, [(lo, point), (point, hi)]
+
+    probes = 0
+    while intervals and len(points) + 1 < shards and probes < shards * 4:
+        probes += len(intervals)
+        next_intervals = []
+        for point, children in parallel_map(split, intervals, parallel):
+            if point is not None:
+                points.append(point)
+            next_intervals.extend(children)
+        intervals = next_intervals
+    points.sort(key=functools.cmp_to_key(compare_primary_keys))
+    bounds = [start_primary_keys] + points + [end_primary_keys]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def scan_shard(client, table, shard, start_primary_keys, end_primary_keys, emit, columns_to_get=None, column_filter=None):
+    count = 0
+    now = time.time()
+    for page in iter_range(client, table, start_primary_keys, end_primary_keys, columns_to_get, column_filter):
+        for row in page:
+            emit(row)
+        count += len(page)
+    elapsed = time.time() - now
+    sys.stderr.write(json.dumps({
+        "Shard": shard,
+        "Rows": count,
+        "Elapsed": round(elapsed, 3),
+        "RowsPerSecond": round(count / elapsed, 2) if elapsed > 0 else count,
+    }) + "\n")
+
+
+def parallel_get_range(client, table, parallel=8, ordered=True, shards=0, columns_to_get=None, column_filter=None, start=None, end=None):
+    # shards 为 0 时按 parallel * 4 切分
+    ranges = compute_split_ranges(client, table, table_schema(client, table), shards or parallel * 4, start, end, parallel)
+
+    # 每个分片一个队列，分片结束时放入 None，出错时放入异常；无序输出时所有分片共用一个队列
+    shared = queue.Queue(maxsize=1000 * parallel)
+    queues = [queue.Queue(maxsize=1000) if ordered else shared for _ in ranges]
+    stop = threading.Event()
+
+    def put(q, item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+        raise InterruptedError("scan stopped")
+
+    def worker(shard):
+        if stop.is_set():
+            return
+        try:
+            scan_shard(
+                client, table, shard, ranges[shard][0], ranges[shard][1], lambda row: put(queues[shard], row),
+                columns_to_get, column_filter
+            )
+            put(queues[shard], None)
+        except InterruptedError:
+            pass
+        except Exception as e:
+            put(queues[shard], e)
+
+    def drain(q, n):
+        done = 0
+        while done < n:
+            item = q.get()
+            if item is None:
+                done += 1
+                continue
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    pending = queue.Queue()
+    for shard in range(len(ranges)):
+        pending.put(shard)
+
+    def run():
+        while not stop.is_set():
+            try:
+                shard = pending.get_nowait()
+            except queue.Empty:
+                return
+            worker(shard)
+
+    # 使用 daemon 线程而不是线程池，消费方提前退出（如输出到 head 时 BrokenPipe）而生成器没有被关闭时，
+    # 阻塞在队列上的线程不会阻止进程退出；生成器关闭时 stop 让所有线程在 1 秒内退出
+    for _ in range(min(parallel, len(ranges))):
+        threading.Thread(target=run, daemon=True).start()
+    try:
+        if ordered:
+            for q in queues:
+                yield from drain(q, 1)
+        else:
+            yield from drain(shared, len(ranges))
+    finally:
+        stop.set()
+
+
+# 导出文件由若干个 block 组成，每个 block 为 4 字节长度 + zlib 压缩的 json：
+# {"PrimaryKeys": [主键名], "Columns": [列名], "Rows": [[主键值..., 列值...]]}
+# 每写完一个 block 在 <file>.checkpoint 中记录文件长度和下一页的起始主键，中断后从该位置继续，导出完成后删除 checkpoint
+def encode_value(val):
+    if isinstance(val, (bytes, bytearray)):
+        return {"B": base64.b64encode(bytes(val)).decode()}
+    return val
+
+
+def decode_value(val):
+    if isinstance(val, dict) and "B" in val:
+        return bytearray(base64.b64decode(val["B"]))
+    return val
+
+
+def encode_block(keys, rows):
+    columns = sorted({col for row in rows for col in row["Columns"]})
+    return zlib.compress(json.dumps({
+        "PrimaryKeys": keys,
+        "Columns": columns,
+        "Rows": [
+            [encode_value(row["PrimaryKeys"][key]) for key in keys] + [encode_value(row["Columns"].get(col)) for col in columns]
+            for row in rows
+        ],
+    }, separators=(",", ":")).encode())
+
+
+def decode_block(data):
+    block = json.loads(zlib.decompress(data))
+    keys = block["PrimaryKeys"]
+    columns = block["Columns"]
+    for vals in block["Rows"]:
+        yield {
+            "PrimaryKeys": {key: decode_value(val) for key, val in zip(keys, vals)},
+            "Columns": {col: decode_value(val) for col, val in zip(columns, vals[len(keys):]) if val is not None},
+        }
+
+
+def save_checkpoint(filename, checkpoint):
+    tmp = "{}.tmp".format(filename)
+    with open(tmp, "w") as fp:
+        json.dump(checkpoint, fp)
+    os.replace(tmp, filename)
+
+
+def export_table(client, table, filename, columns_to_get=None, column_filter=None, start=None, end=None):
+    keys = table_keys(client, table)
+    start_primary_keys, end_primary_keys = make_range_bounds(keys, start, end)
+    checkpoint_file = "{}.checkpoint".format(filename)
+    checkpoint = {"Offset": 0, "Rows": 0, "Blocks": 0, "Done": False}
+    if os.path.exists(checkpoint_file) and os.path.exists(filename):
+        with open(checkpoint_file) as fp:
+            checkpoint = json.load(fp)
+    if checkpoint["Done"]:
+        # 旧版本导出完成后保留的 checkpoint，重新导出
+        checkpoint = {"Offset": 0, "Rows": 0, "Blocks": 0, "Done": False}
+    if checkpoint["Offset"] > 0:
+        start_primary_keys = [(key, decode_value(val)) for key, val in checkpoint["NextStartPrimaryKey"]]
+    resumed = checkpoint["Offset"] > 0
+
+    now = time.time()
+    with open(filename, "r+b" if resumed else "wb") as fp:
+        # 丢弃上次中断时写了一半的 block
+        fp.truncate(checkpoint["Offset"])
+        fp.seek(checkpoint["Offset"])
+        for page, next_start_primary_keys in iter_range_with_next(client, table, start_primary_keys, end_primary_keys, columns_to_get, column_filter):
+            if page:
+                data = encode_block(keys, page)
+                fp.write(struct.pack(">I", len(data)))
+                fp.write(data)
+                fp.flush()
+                os.fsync(fp.fileno())
+            checkpoint["Offset"] = fp.tell()
+            checkpoint["Rows"] += len(page)
+            checkpoint["Blocks"] += 1 if page else 0
+            checkpoint["Done"] = next_start_primary_keys is None
+            checkpoint["NextStartPrimaryKey"] = [[key, encode_value(val)] for key, val in next_start_primary_keys or []]
+            save_checkpoint(checkpoint_file, checkpoint)
+            sys.stderr.write(json.dumps({"Rows": checkpoint["Rows"], "Bytes": checkpoint["Offset"]}) + "\n")
+    # 导出完成后删除 checkpoint，再次执行时重新导出，而不是直接返回上一次的结果
+    if checkpoint["Done"]:
+        os.remove(checkpoint_file)
+    return dict(checkpoint, Resumed=resumed, Elapsed=round(time.time() - now, 3))
+
+
+def read_export(filename):
+    with open(filename, "rb") as fp:
+        while True:
+            header = fp.read(4)
+            if len(header) < 4:
+                break
+            size = struct.unpack(">I", header)[0]
+            data = fp.read(size)
+            if len(data) < size:
+                break
+            yield from decode_block(data)
+
+
+def import_table(client, table, filename, parallel=8, retry=5, max_parallel=64):
+    return batch_write_rows(client, table, read_export(filename), "put", parallel, retry=retry, max_parallel=max_parallel)
+
+
+def make_transform(spec):
+    # {"PrimaryKeys": {"旧主键名": "新主键名"}, "Columns": {"旧列名": "新列名"}, "Set": {"PrimaryKeys": {...}, "Columns": {...}}}
+    if not spec:
+        return None
+    pk_names = spec.get("PrimaryKeys", {})
+    col_names = spec.get("Columns", {})
+    set_pks = spec.get("Set", {}).get("PrimaryKeys", {})
+    set_cols = spec.get("Set", {}).get("Columns", {})
+
+    def transform(row):
+        pkmap = {pk_names.get(k, k): v for k, v in row["PrimaryKeys"].items()}
+        colmap = {col_names.get(k, k): v for k, v in row["Columns"].items()}
+        pkmap.update(set_pks)
+        colmap.update(set_cols)
+        return {"PrimaryKeys": pkmap, "Columns": colmap}
+    return transform
+
+
+def copy_table(client, table, target_client, target_table, parallel=8, shards=0, transform=None,
+               columns_to_get=None, column_filter=None, retry=5, max_parallel=64, start=None, end=None):
+    # 多个分片并发读取源表，经有界队列交给批量写入的线程池写目标表
+    # start/end 限定复制的主键范围，分片只在这个范围内切分
+    # 写入出错时关闭读取的生成器，停止扫描线程
+    now = time.time()
+    scan = parallel_get_range(client, table, parallel, False, shards, columns_to_get, column_filter, start, end)
+    with contextlib.closing(scan):
+        rows = (transform(row) for row in scan) if transform else scan
+        res = batch_write_rows(target_client, target_table, rows, "put", parallel, retry=retry, max_parallel=max_parallel)
+    return dict(res, Elapsed=round(time.time() - now, 3))
 
 
 def put_row(client, table, row, change=False):
@@ -78,15 +513,14 @@ def put_row(client, table, row, change=False):
         return False
     # 如果行不存在，插入新行
     # 如果行存在，覆盖当前行，row 中不存在的列会被删除，等效于删除整行，再插入整行
-    meta = client.describe_table(table)
-    keys = [v[0] for v in meta.table_meta.schema_of_primary_key]
+    keys = table_keys(client, table)
     pks = []
     for key in keys:
         pks.append((key, row["PrimaryKeys"][key]))
     cols = []
     for col in row["Columns"]:
         cols.append((col, row["Columns"][col]))
-    _, _ = client.put_row(table, tablestore.Row(pks, cols))
+    _, _ = row_write_limiter.call(client.put_row, table, tablestore.Row(pks, cols))
     return True
 
 
@@ -105,21 +539,21 @@ def update_row(client, table, row, change=False, view=True):
         return False
     # 如果行不存在，插入行
     # 如果行存在，修改或者新增 row 中的行，row 中不存在的列不变
-    meta = client.describe_table(table)
-    keys = [v[0] for v in meta.table_meta.schema_of_primary_key]
+    keys = table_keys(client, table)
     pks = []
     for key in keys:
         pks.append((key, row["PrimaryKeys"][key]))
     cols = []
     for col in row["Columns"]:
         cols.append((col, row["Columns"][col]))
-    _, _ = client.update_row(table, tablestore.Row(pks, {"PUT": cols}), tablestore.Condition(tablestore.RowExistenceExpectation.IGNORE))
+    _, _ = row_write_limiter.call(
+        client.update_row, table, tablestore.Row(pks, {"PUT": cols}), tablestore.Condition(tablestore.RowExistenceExpectation.IGNORE)
+    )
     return True
 
 
 def get_row(client, table, primary_key):
-    meta = client.describe_table(table)
-    keys = [v[0] for v in meta.table_meta.schema_of_primary_key]
+    keys = table_keys(client, table)
     pks = []
     for key in keys:
         pks.append((key, primary_key[key]))
@@ -132,6 +566,279 @@ def get_row(client, table, primary_key):
     return {"PrimaryKeys": primary_key, "Columns": colmap}
 
 
+# 行级别可重试的错误码，其他错误（如参数错误）重试也不会成功
+retryable_row_errors = {
+    "OTSServerBusy", "OTSCapacityUnitExhausted", "OTSQuotaExhausted", "OTSNotEnoughCapacityUnit",
+    "OTSTimeout", "OTSServerUnavailable", "OTSInternalServerError", "OTSPartitionUnavailable",
+    "OTSRowOperationConflict", "OTSTableNotReady",
+}
+
+
+# 服务端限流相关的错误码，出现时写入并发减半
+throttle_errors = {
+    "OTSServerBusy", "OTSCapacityUnitExhausted", "OTSQuotaExhausted", "OTSNotEnoughCapacityUnit",
+}
+
+
+class WriteLimiter(object):
+    # 写入并发控制（AIMD）：延迟稳定时每成功 limit 个请求并发加一，遇到限流时并发减半
+    def __init__(self, initial=8, maximum=64, minimum=1):
+        self.minimum = minimum
+        self.maximum = max(maximum, minimum)
+        self.limit = max(minimum, min(initial, self.maximum))
+        self.inflight = 0
+        self.successes = 0
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+        self.latency = None
+        self.base_latency = None
+        self.last_decrease = 0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while self.inflight >= self.limit:
+                self.cond.wait()
+            self.inflight += 1
+
+    def release(self, latency, error=None):
+        with self.cond:
+            self.inflight -= 1
+            self.requests += 1
+            if error in throttle_errors:
+                self.throttled += 1
+                # 同一时刻在途的请求一起被限流时只减一次
+                if time.time() - self.last_decrease > (self.latency or 0):
+                    self.limit = max(self.minimum, self.limit // 2)
+                    self.last_decrease = time.time()
+                self.successes = 0
+            elif error:
+                self.errors += 1
+            else:
+                self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+                self.base_latency = self.latency if self.base_latency is None else min(self.base_latency, self.latency)
+                self.successes += 1
+                if self.successes >= self.limit and self.latency <= 2 * self.base_latency:
+                    self.limit = min(self.maximum, self.limit + 1)
+                    self.successes = 0
+            self.cond.notify_all()
+
+    def call(self, fn, *args, check=None, retry=5, **kwargs):
+        # check 从返回结果中提取行级错误码，用于批量请求部分行被限流的情况
+        for i in range(retry + 1):
+            self.acquire()
+            now = time.time()
+            try:
+                res = fn(*args, **kwargs)
+            except tablestore.OTSServiceError as e:
+                self.release(time.time() - now, e.get_error_code())
+                if e.get_error_code() not in throttle_errors or i == retry:
+                    raise
+                time.sleep(min(0.1 * 2 ** i, 5) * (0.5 + random.random()))
+                continue
+            except Exception:
+                self.release(time.time() - now, "ClientError")
+                raise
+            self.release(time.time() - now, check(res) if check else None)
+            return res
+
+    def stat(self):
+        with self.cond:
+            return {
+                "Limit": self.limit,
+                "Requests": self.requests,
+                "ThrottleRate": round(self.throttled / self.requests, 4) if self.requests else 0,
+                "ErrorRate": round(self.errors / self.requests, 4) if self.requests else 0,
+            }
+
+
+# 单行写入（PutRow/UpdateRow）串行执行，只使用限流退避
+row_write_limiter = WriteLimiter(1, 1)
+
+
+def iter_rows(rows=None):
+    # rows 为空从 stdin 读取，以 @ 开头从文件读取，文件可以是 json 数组或者每行一个 json
+    if not rows:
+        for line in sys.stdin:
+            if line.strip():
+                yield json.loads(line)
+        return
+    if rows[0] != "@":
+        rows = json.loads(rows)
+        yield from (rows if isinstance(rows, list) else [rows])
+        return
+    with open(rows[1:]) as fp:
+        first = fp.read(1)
+        while first.isspace():
+            first = fp.read(1)
+        fp.seek(0)
+        if first == "[":
+            yield from json.load(fp)
+            return
+        for line in fp:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_batches(rows, max_rows=200, max_bytes=4 * 1024 * 1024):
+    batch = []
+    size = 0
+    for row in rows:
+        row_size = len(json.dumps(row, default=str))
+        if batch and (len(batch) >= max_rows or size + row_size > max_bytes):
+            yield batch
+            batch = []
+            size = 0
+        batch.append(row)
+        size += row_size
+    if batch:
+        yield batch
+
+
+def make_row_item(keys, row, kind):
+    pks = [(key, row["PrimaryKeys"][key]) for key in keys]
+    cols = [(col, row["Columns"][col]) for col in row.get("Columns", {})]
+    condition = tablestore.Condition(tablestore.RowExistenceExpectation.IGNORE)
+    if kind == "update":
+        return tablestore.UpdateRowItem(tablestore.Row(pks, {"PUT": cols}), condition)
+    if kind == "delete":
+        return tablestore.DeleteRowItem(tablestore.Row(pks), condition)
+    return tablestore.PutRowItem(tablestore.Row(pks, cols), condition)
+
+
+def write_batch(client, table, keys, batch, kind="put", retry=5, limiter=None):
+    # 只重试失败的行，返回写入失败的行及错误信息
+    limiter = limiter or WriteLimiter(1, 1)
+
+    def check(res):
+        for item in getattr(res, "get_{}_by_table".format(kind))(table):
+            if not item.is_ok and item.error_code in throttle_errors:
+                return item.error_code
+        return None
+
+    failed = []
+    for i in range(retry + 1):
+        if i > 0:
+            time.sleep(min(0.1 * 2 ** i, 5))
+        req = tablestore.BatchWriteRowRequest()
+        req.add(tablestore.TableInBatchWriteRowItem(table, [make_row_item(keys, row, kind) for row in batch]))
+        res = limiter.call(client.batch_write_row, req, check=check, retry=retry)
+        items = getattr(res, "get_{}_by_table".format(kind))(table)
+        errors = [(row, item) for row, item in zip(batch, items) if not item.is_ok]
+        batch = [row for row, item in errors if item.error_code in retryable_row_errors]
+        failed.extend((row, item) for row, item in errors if item.error_code not in retryable_row_errors or i == retry)
+        if not batch:
+            break
+    return [{"Row": row, "ErrorCode": item.error_code, "ErrorMessage": item.error_message} for row, item in failed]
+
+
+def batch_write_rows(client, table, rows, kind="put", parallel=8, max_rows=200, max_bytes=4 * 1024 * 1024, retry=5, max_parallel=64):
+    # 以 parallel 个并发开始，由 WriteLimiter 根据延迟和限流错误在 [1, max_parallel] 之间调整
+    keys = table_keys(client, table)
+    limiter = WriteLimiter(parallel, max(parallel, max_parallel))
+    now = time.time()
+    last = now
+    stat = {"Rows": 0, "Failed": 0}
+    failed_rows = []
+
+    def collect(futures):
+        nonlocal last
+        for future in futures:
+            count, failed = future.result()
+            stat["Rows"] += count
+            stat["Failed"] += len(failed)
+            failed_rows.extend(failed)
+        if time.time() - last >= 1:
+            last = time.time()
+            sys.stderr.write(json.dumps(dict(stat, RowsPerSecond=round(stat["Rows"] / (last - now), 2), **limiter.stat())) + "\n")
+
+    def work(batch):
+        return len(batch), write_batch(client, table, keys, batch, kind, retry, limiter)
+
+    with ThreadPoolExecutor(max_workers=limiter.maximum) as executor:
+        futures = set()
+        for batch in iter_batches(rows, max_rows, max_bytes):
+            if len(futures) >= limiter.maximum * 2:
+                done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                collect(done)
+            futures.add(executor.submit(work, batch))
+        collect(wait(futures).done)
+
+    elapsed = time.time() - now
+    return dict(
+        stat, Elapsed=round(elapsed, 3), RowsPerSecond=round(stat["Rows"] / elapsed, 2) if elapsed > 0 else stat["Rows"],
+        FailedRows=failed_rows, **limiter.stat()
+    )
+
+
+def parallel_map(fn, items, parallel=8):
+    # 按输入顺序返回结果，最多 parallel * 2 个任务在途，不会一次性读入全部输入
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        futures = collections.deque()
+        for item in items:
+            if len(futures) >= parallel * 2:
+                yield futures.popleft().result()
+            futures.append(executor.submit(fn, item))
+        while futures:
+            yield futures.popleft().result()
+
+
+def batch_get_rows(client, table, keys, primary_keys, retry=5):
+    # 返回与 primary_keys 顺序一致的行，行不存在时为 None
+    res = [None] * len(primary_keys)
+    todo = list(range(len(primary_keys)))
+    for i in range(retry + 1):
+        if i > 0:
+            time.sleep(min(0.1 * 2 ** i, 5))
+        req = tablestore.BatchGetRowRequest()
+        req.add(tablestore.TableInBatchGetRowItem(table, [[(key, primary_keys[j][key]) for key in keys] for j in todo], max_version=1))
+        items = client.batch_get_row(req).get_result_by_table(table)
+        failed = []
+        for j, item in zip(todo, items):
+            if not item.is_ok:
+                if item.error_code not in retryable_row_errors or i == retry:
+                    raise tablestore.OTSServiceError(500, item.error_code, item.error_message)
+                failed.append(j)
+            elif item.row is not None:
+                res[j] = {"PrimaryKeys": primary_keys[j], "Columns": {col[0]: col[1] for col in item.row.attribute_columns}}
+        todo = failed
+        if not todo:
+            break
+    return res
+
+
+def batch_diff_rows(client, table, rows, kind="put", parallel=8, retry=5):
+    # 批量读取当前行并与输入比较，只输出有变化的行的 diff，最后返回汇总
+    keys = table_keys(client, table)
+    stat = {"Added": 0, "Changed": 0, "Unchanged": 0}
+
+    def work(batch):
+        return batch, batch_get_rows(client, table, keys, [row["PrimaryKeys"] for row in batch], retry)
+
+    for batch, olds in parallel_map(work, iter_batches(rows, max_rows=100), parallel):
+        for row, old in zip(batch, olds):
+            if old is None:
+                stat["Added"] += 1
+                continue
+            if kind == "update":
+                old["Columns"] = {k: v for k, v in old["Columns"].items() if k in row["Columns"]}
+            if old["Columns"] == row["Columns"]:
+                stat["Unchanged"] += 1
+                continue
+            stat["Changed"] += 1
+            print(json.dumps(row["PrimaryKeys"]))
+            diff.color_diff(old, row)
+    return stat
+
+
+canary_deploy_keys = ["ObjectType", "ObjectId", "Provider", "Function"]
+
+
+def canary_deploy_key(deploy):
+    return tuple(deploy[k] for k in canary_deploy_keys)
+
+
 def get_canary_deploy(client, table, primary_key, column):
     row = get_row(client, table, primary_key)
     canary_deploys = row["Columns"][column]
@@ -143,12 +850,12 @@ def put_canary_deploy(client, table, primary_key, column, deploy, change=False):
     new_deploys = [deploy]
     od = None
     for old_deploy in old_deploys:
-        if all([old_deploy[k] == deploy[k] for k in ["ObjectType", "ObjectId", "Provider", "Function"]]):
+        if canary_deploy_key(old_deploy) == canary_deploy_key(deploy):
             od = old_deploy
             continue
         new_deploys.append(old_deploy)
-    old_deploys.sort(key=lambda x: (x["ObjectType"], x["ObjectId"], x["Provider"], x["Function"]))
-    new_deploys.sort(key=lambda x: (x["ObjectType"], x["ObjectId"], x["Provider"], x["Function"]))
+    old_deploys.sort(key=canary_deploy_key)
+    new_deploys.sort(key=canary_deploy_key)
     if not change:
         diff.color_diff(od, deploy)
     return update_row(client, table, {"PrimaryKeys": primary_key, "Columns": {column: json.dumps(new_deploys)}}, change, view=False)
@@ -158,7 +865,7 @@ def del_canary_deploy(client, table, primary_key, column, deploy, change=False):
     old_deploys = get_canary_deploy(client, table, primary_key, column)
     new_deploys = []
     for old_deploy in old_deploys:
-        if all([old_deploy[k] == deploy[k] for k in ["ObjectType", "ObjectId", "Provider", "Function"]]):
+        if canary_deploy_key(old_deploy) == canary_deploy_key(deploy):
             continue
         new_deploys.append(old_deploy)
     if len(old_deploys) == len(new_deploys):
@@ -168,23 +875,120 @@ def del_canary_deploy(client, table, primary_key, column, deploy, change=False):
     return update_row(client, table, {"PrimaryKeys": primary_key, "Columns": {column: json.dumps(new_deploys)}}, change, view=False)
 
 
-def get_task(client, table, owner_id, project, task_id):
+def batch_canary_deploy(client, table, primary_key, column, deploys=None, del_deploys=None, change=False, retry=5):
+    # 一次读改写应用多个 deploy 的新增/修改（deploys）和删除（del_deploys），先删除后新增
+    # 以读到的列值作为条件更新，其他人在此期间修改过该列时条件检查失败，重新读取后重试
+    deploys = deploys or []
+    del_deploys = del_deploys or []
+    for i in range(retry + 1):
+        row = get_row(client, table, primary_key)
+        old_value = row["Columns"][column]
+        index = {canary_deploy_key(deploy): deploy for deploy in json.loads(old_value)}
+        old_deploys = dict(index)
+        res = {"Added": 0, "Changed": 0, "Deleted": 0, "NotFound": 0, "Unchanged": 0, "Retries": i}
+        for deploy in del_deploys:
+            if index.pop(canary_deploy_key(deploy), None) is None:
+                res["NotFound"] += 1
+            else:
+                res["Deleted"] += 1
+        for deploy in deploys:
+            key = canary_deploy_key(deploy)
+            if key not in index:
+                res["Added"] += 1
+            elif index[key] == deploy:
+                res["Unchanged"] += 1
+            else:
+                res["Changed"] += 1
+            index[key] = deploy
+        new_deploys = [index[key] for key in sorted(index)]
+        if not change:
+            diff.color_diff([old_deploys[key] for key in sorted(old_deploys)], new_deploys)
+            return res
+        if res["Added"] + res["Changed"] + res["Deleted"] == 0:
+            return res
+        pks = [(key, primary_key[key]) for key in table_keys(client, table)]
+        condition = tablestore.Condition(
+            tablestore.RowExistenceExpectation.EXPECT_EXIST,
+            tablestore.SingleColumnCondition(column, old_value, tablestore.ComparatorType.EQUAL, pass_if_missing=False)
+        )
+        try:
+            row_write_limiter.call(client.update_row, table, tablestore.Row(pks, {"PUT": [(column, json.dumps(new_deploys))]}), condition)
+            return res
+        except tablestore.OTSServiceError as e:
+            if e.get_error_code() != "OTSConditionCheckFail" or i == retry:
+                raise
+            time.sleep(min(0.1 * 2 ** i, 5) * (0.5 + random.random()))
+
+
+def task_primary_key(owner_id, project, task_id):
     suffix = "{:04X}".format(fnv.hash(task_id.encode(), algorithm=fnv.fnv_1a, bits=32) % 0x10000)
     upa = "{}:{}:{}:{}".format(owner_id, project, task_id.split('-')[0], suffix)
-    return get_row(client, table, {"UPA": upa, "TaskID": task_id})
+    return {"UPA": upa, "TaskID": task_id}
+
+
+def get_task(client, table, owner_id, project, task_id):
+    return get_row(client, table, task_primary_key(owner_id, project, task_id))
+
+
+def batch_get_task(client, table, owner_id, project, task_ids, parallel=8):
+    # 按输入顺序返回找到的任务，不存在的任务以 {"Missing": task_id} 返回
+    # 重复的任务 id 只查询和返回一次，task_ids 可以是生成器，边读边查
+    keys = table_keys(client, table)
+
+    def unique(ids):
+        seen = set()
+        for task_id in ids:
+            if task_id not in seen:
+                seen.add(task_id)
+                yield task_id
+
+    def work(batch):
+        return batch, batch_get_rows(client, table, keys, [task_primary_key(owner_id, project, task_id) for task_id in batch])
+
+    for batch, rows in parallel_map(work, iter_batches(unique(task_ids), max_rows=100), parallel):
+        for task_id, row in zip(batch, rows):
+            yield row if row is not None else {"Missing": task_id}
 
 
-def get_configcenter(client, kms_client, table):
+def print_batch_get_task(client, table, owner_id, project, lines, parallel=8):
+    # 命令行使用，找到的任务输出到 stdout，返回不存在的任务 id
+    missing = []
+    task_ids = (line.strip() for line in lines if line.strip())
+    for row in batch_get_task(client, table, owner_id, project, task_ids, parallel):
+        if "Missing" in row:
+            missing.append(row["Missing"])
+            continue
+        sys.stdout.write(json.dumps(row) + "\n")
+    return missing
+
+
+def get_configcenter(client, kms_client, table, parallel=8):
+    # 扫描的同时在线程池中解密，相同密文只解密一次
+    now = time.time()
     res = {}
-    for row in get_range(client, table):
-        block = row["PrimaryKeys"]["Block"]
-        section = row["PrimaryKeys"]["Section"]
-        key = row["PrimaryKeys"]["Key"]
-        val = row["Columns"]["Value"]
-        if key.startswith("@"):
-            key = key[1:]
-            val = base64.b64decode(kms.decrypt(kms_client, val)["Plaintext"]).decode()
-        res["{}_{}_{}".format(block, section, key)] = val
+    futures = {}
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        for row in get_range(client, table, ["Value"]):
+            block = row["PrimaryKeys"]["Block"]
+            section = row["PrimaryKeys"]["Section"]
+            key = row["PrimaryKeys"]["Key"]
+            val = row["Columns"]["Value"]
+            if key.startswith("@"):
+                key = key[1:]
+                val = executor.submit(kms.memo_decrypt, kms_client, val)
+                futures["{}_{}_{}".format(block, section, key)] = val
+            res["{}_{}_{}".format(block, section, key)] = val
+        scan_elapsed = time.time() - now
+        for key in futures:
+            res[key] = base64.b64decode(futures[key].result()["Plaintext"]).decode()
+    elapsed = time.time() - now
+    sys.stderr.write(json.dumps({
+        "Keys": len(res),
+        "Encrypted": len(futures),
+        "Scan": round(scan_elapsed, 3),
+        "DecryptWait": round(elapsed - scan_elapsed, 3),
+        "Elapsed": round(elapsed, 3),
+    }) + "\n")
     return res
 
 
@@ -208,28 +1012,116 @@ def get_configcenter_key(client, kms_client, table, pk):
     return res["Columns"]["Value"]
 
 
+# 加密的配置在 Digest 列中保存明文的加盐摘要，同步时本地比较摘要，不需要逐个调用 kms 解密
+# 使用 pbkdf2 和随机盐，摘要泄露时也难以通过字典反推出明文
+digest_iterations = 10000
+
+
+def value_digest(val, salt=None):
+    salt = salt or os.urandom(16)
+    dk = hashlib.pbkdf2_hmac("sha256", val.encode(), salt, digest_iterations)
+    return "pbkdf2_sha256${}${}${}".format(digest_iterations, base64.b64encode(salt).decode(), dk.hex())
+
+
+def match_digest(digest, val):
+    try:
+        _, iterations, salt, expected = digest.split("$")
+        dk = hashlib.pbkdf2_hmac("sha256", val.encode(), base64.b64decode(salt), int(iterations))
+    except ValueError:
+        return False
+    return hmac.compare_digest(dk.hex(), expected)
+
+
 def put_configcenter(client, table, config, change, kms_client, cmkey, encrypt):
     for pk in config:
         put_configcenter_key(client, table, pk, config[pk], change, kms_client, cmkey, encrypt)
 
 
+def sync_configcenter(client, table, config, change, kms_client, cmkey, encrypt, prune=False, parallel=8):
+    # 一次扫描加载当前配置，本地计算差异，只批量写入新增和变化的 key，prune 时删除配置中不存在的 key
+    # 加密的 key 与 Digest 列中的摘要比较，只有没有摘要的旧数据才调用 kms 解密，并在 change 时补上摘要
+    current = {}
+    for row in get_range(client, table, ["Value", "Digest"]):
+        pk = row["PrimaryKeys"]
+        key = pk["Key"][1:] if pk["Key"].startswith("@") else pk["Key"]
+        current["{}_{}_{}".format(pk["Block"], pk["Section"], key)] = {
+            "PrimaryKeys": pk, "Value": row["Columns"].get("Value"), "Digest": row["Columns"].get("Digest"),
+        }
+
+    def same(cur, val):
+        if cur["Digest"]:
+            return match_digest(cur["Digest"], val)
+        return base64.b64decode(kms.memo_decrypt(kms_client, cur["Value"])["Plaintext"]).decode() == val
+
+    res = {"Added": [], "Changed": [], "Removed": [], "Unchanged": 0}
+    puts = []
+    deletes = []
+    backfills = []
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        sames = {}
+        for name, val in config.items():
+            if name in current and current[name]["PrimaryKeys"]["Key"].startswith("@"):
+                sames[name] = executor.submit(same, current[name], val)
+        for name, val in config.items():
+            block, section, key = name.split("_", 2)
+            cur = current.get(name)
+            if cur is None:
+                res["Added"].append(name)
+            else:
+                encrypted = cur["PrimaryKeys"]["Key"].startswith("@")
+                unchanged = sames[name].result() if encrypted else cur["Value"] == val
+                if unchanged and encrypted == bool(encrypt):
+                    res["Unchanged"] += 1
+                    if encrypted and not cur["Digest"]:
+                        backfills.append((cur["PrimaryKeys"], val))
+                    continue
+                res["Changed"].append(name)
+                # 加密方式变化时 key 不同，需要删除旧的行
+                if encrypted != bool(encrypt):
+                    deletes.append({"PrimaryKeys": cur["PrimaryKeys"]})
+            puts.append(({"Block": block, "Section": section, "Key": "@{}".format(key) if encrypt else key}, val))
+        for name in current:
+            if name not in config:
+                res["Removed"].append(name)
+                if prune:
+                    deletes.append({"PrimaryKeys": current[name]["PrimaryKeys"]})
+        if not change:
+            return res
+        if encrypt:
+            puts = [(pk, val, executor.submit(kms.encrypt, kms_client, cmkey, base64.b64encode(val.encode())), executor.submit(value_digest, val)) for pk, val in puts]
+            rows = [{"PrimaryKeys": pk, "Columns": {"Value": ciphertext.result()["CiphertextBlob"], "Digest": digest.result()}} for pk, _, ciphertext, digest in puts]
+        else:
+            rows = [{"PrimaryKeys": pk, "Columns": {"Value": val}} for pk, val in puts]
+        digests = [{"PrimaryKeys": pk, "Columns": {"Digest": digest}} for (pk, _), digest in zip(backfills, executor.map(value_digest, [val for _, val in backfills]))]
+
+    if rows:
+        res["Put"] = batch_write_rows(client, table, rows, "put", parallel)
+    if digests:
+        res["Digest"] = batch_write_rows(client, table, digests, "update", parallel)
+    if deletes:
+        res["Delete"] = batch_write_rows(client, table, deletes, "delete", parallel)
+    return res
+
+
 def put_configcenter_key(client, table, pk, val, change, kms_client, cmkey, encrypt):
     vs = pk.split("_")
     block = vs[0]
     section = vs[1]
     key = vs[2]
+    columns = {"Value": val}
     if encrypt:
         key = "@{}".format(key)
-        val = kms.encrypt(kms_client, cmkey, base64.b64encode(val.encode()))["CiphertextBlob"]
+        columns = {
+            "Value": kms.encrypt(kms_client, cmkey, base64.b64encode(val.encode()))["CiphertextBlob"],
+            "Digest": value_digest(val),
+        }
     return put_row(client, table, {
         "PrimaryKeys": {
             "Block": block,
             "Section": section,
             "Key": key
         },
-        "Columns": {
-            "Value": val
-        }
+        "Columns": columns
     }, change)
 
 
@@ -252,8 +1144,21 @@ def main():
   ]'
   python3 ots.py -c ~/.aksk/imm-dev -r cn-shanghai -d imm-dev-hl -a DescribeTable -t yaconfig
   python3 ots.py -c ~/.aksk/imm-dev -r cn-shanghai -d imm-dev-hl -a ListTable
+  python3 ots.py -c ~/.aksk/imm-dev -r cn-shanghai -d imm-dev-hl -t IMMConfig -a GetRow --primary-keys '{"Block": "Base", "Section": "Common"}' --schema-cache ~/.ots-schema.json --invalidate-schema-cache
   python3 ots.py -c ~/.aksk/imm-dev -r cn-shanghai -d imm-dev-hl -t ImmTasks -a GetTask --owner 1023210024677934 --project imm-test-hl-doc-proj-shanghai --task formatconvert-00402572-d8e9-4750-ab88-ac3f388f63d1
+  grep -o 'formatconvert-[0-9a-f-]*' app.log | sort -u | python3 ots.py -c ~/.aksk/imm-dev -r cn-shanghai -d imm-dev-hl -t ImmTasks -a BatchGetTask --owner 1023210024677934 --project imm-test-hl-doc-proj-shanghai
+  python3 ots.py -c ~/.aksk/imm-dev -r cn-shanghai -d imm-dev-hl -t ImmTasks -a BatchGetTask --owner 1023210024677934 --project imm-test-hl-doc-proj-shanghai --task formatconvert-1,formatconvert-2
   python3 ots.py -c ~/.aksk/imm-dev -r cn-shanghai -d imm-dev-hl -t IMMConfig -a GetRange > IMMConfig.json
+  python3 ots.py -c ~/.aksk/imm-dev -r cn-shanghai -d imm-dev-hl -t ImmTasks -a GetRange --parallel 16 --scan-order unordered > ImmTasks.json
+  python3 ots.py -c ~/.aksk/imm-dev -r cn-shanghai -d imm-dev-hl -t IMMConfig -a GetRange --columns-to-get CanaryDeploy --start-primary-keys '{"Block": "Base"}' --end-primary-keys '{"Block": "Basf"}'
+  python3 ots.py -c ~/.aksk/imm-dev -r cn-shanghai -d imm-dev-hl -t IMMConfig -a GetRange --columns-to-get Value --filter '{
+    "Operator": "OR", "Conditions": [
+      {"Column": "Enable", "Comparator": "==", "Value": true},
+      {"Column": "Percent", "Comparator": ">=", "Value": 50}
+    ]
+  }'
+  python3 ots.py -c ~/.aksk/imm-dev -r cn-shanghai -d imm-dev-hl -t ImmTasks -a Export --file ImmTasks.ots
+  python3 ots.py -c ~/.aksk/imm-dev -r cn-shanghai -d imm-dev-hl -t ImmTasks -a Import --file ImmTasks.ots --parallel 8
   python3 ots.py -c ~/.aksk/imm-dev -r cn-shanghai -d imm-dev-hl -t IMMConfig -a GetRow --primary-keys '{"Block": "WebOfficeBilling", "Section": "SLS"}'
   python3 ots.py -c ~/.aksk/imm-dev -r cn-shanghai -d imm-dev-hl -t IMMConfig -a PutRow --rows '{"PrimaryKeys": {"Block": "WebOfficeBilling", "Section": "SLS"}, "Columns": {"Enable": true}}'
   python3 ots.py -c ~/.aksk/imm-dev -r cn-shanghai -d imm-dev-hl -t IMMConfig -a PutRow --primary-keys '{"Block": "WebOfficeBilling", "Section": "SLS"}' --column '{"Enable": false}'
@@ -286,10 +1191,21 @@ def main():
     "Provider": "WPS",
     "Function": "CONVERT"
   }'
+  python3 ots.py -c ~/.aksk/imm-dev -r cn-shanghai -d imm-dev-hl -t IMMConfig -a BatchCanaryDeploy \\
+      --primary-keys '{"Block": "Base", "Section": "Common"}' --column CanaryDeploy --deploys "$(cat deploys.json)" --del-deploys '[
+    {"ObjectType": "user", "ObjectId": "default", "Provider": "WPS", "Function": "CONVERT"}
+  ]' --change
   cat IMMConfig.json | python3 ots.py -c ~/.aksk/imm-dev -r cn-shanghai -d imm-dev-hl -t IMMConfig -a PutRow
+  cat IMMConfig.json | python3 ots.py -c ~/.aksk/imm-dev -r cn-shanghai -d imm-dev-hl -t IMMConfig -a PutRow --batch --parallel 8
+  cat IMMConfig.json | python3 ots.py -c ~/.aksk/imm-dev -r cn-shanghai -d imm-dev-hl -t IMMConfig -a PutRow --batch --parallel 8 --change
+  python3 ots.py -c ~/.aksk/imm-dev -r cn-shanghai -d imm-dev-hl -t IMMConfig -a UpdateRow --batch --rows @IMMConfig.json --change
+  python3 ots.py -c ~/.aksk/imm-dev -r cn-shanghai -d imm-dev-hl -t IMMConfig -a CopyTable --target-instance imm-dev-regressi --parallel 16
+  python3 ots.py -c ~/.aksk/imm-dev -r cn-shanghai -d imm-dev-hl -t IMMConfig -a CopyTable --target-table IMMConfigBak --transform '{"Columns": {"Value": "OldValue"}}'
+  python3 ots.py -c ~/.aksk/imm-dev -r cn-shanghai -d imm-dev-hl -t IMMConfig -a CopyTable --target-table IMMConfigBak --start-primary-keys '{"Block": "Base"}' --end-primary-keys '{"Block": "Basf"}'
   python3 ots.py -c ~/.aksk/imm-dev -r cn-shanghai -d configcenter -t config_imm_dev_hl -a GetConfigCenter
   python3 ots.py -c ~/.aksk/imm-dev -r cn-shanghai -d configcenter -t config_imm_dev_hl -a PutConfigCenter --config "$(cat 1.json)"
   python3 ots.py -c ~/.aksk/imm-dev -r cn-shanghai -d configcenter -t config_imm_dev_hl -a PutConfigCenter --config "$(cat 1.json)" --cmkey "xxx" --encrypt
+  python3 ots.py -c ~/.aksk/imm-dev -r cn-shanghai -d configcenter -t config_imm_dev_hl -a SyncConfigCenter --config "$(cat 1.json)" --cmkey "xxx" --encrypt --prune
   python3 ots.py -c ~/.aksk/imm-dev -r cn-shanghai -d configcenter -t config_imm_dev_hl -a GetConfigCenterByKey --key WebOffice_OSS_AK
   python3 ots.py -c ~/.aksk/imm-dev -r cn-shanghai -d configcenter -t config_imm_dev_hl -a PutConfigCenterByKey --key WebOffice_OSS_AK --value xxx --cmkey "xxx" --encrypt
 """)
@@ -300,6 +1216,10 @@ def main():
     parser.add_argument("-r", "--region-id", help="region id")
     parser.add_argument("-d", "--instance", help="instance")
     parser.add_argument("-t", "--table", help="table")
+    parser.add_argument("--target-endpoint", help="copy table target endpoint")
+    parser.add_argument("--target-instance", help="copy table target instance, default same as instance, target instance and table can not both be the source")
+    parser.add_argument("--target-table", help="copy table target table, default same as table")
+    parser.add_argument("--transform", help="copy table primary key and column transform json format")
     parser.add_argument("--rows", help="row json format")
     parser.add_argument("--primary-keys", help="primary keys json format")
     parser.add_argument("--columns", help="columns json format")
@@ -307,18 +1227,36 @@ def main():
     parser.add_argument("--change", nargs="?", const=True, default=False, type=str2bool, help="change data")
     parser.add_argument("--column", help="column name")
     parser.add_argument("--deploy", help="canary deploy json format")
+    parser.add_argument("--deploys", help="batch canary deploy upserts, json list format")
+    parser.add_argument("--del-deploys", help="batch canary deploy deletes, json list format")
     parser.add_argument("--owner", type=str, help="owner id")
     parser.add_argument("--project", help="project")
-    parser.add_argument("--task", help="task id")
+    parser.add_argument("--task", help="task id, batch get task accept comma separated task ids, read task ids from file if start with @; read from stdin if none")
     parser.add_argument("--key", help="configcenter key")
     parser.add_argument("--value", help="configcenter value")
     parser.add_argument("--cmkey", help="configcenter cmkey")
     parser.add_argument("--config", help="configcenter config")
     parser.add_argument("--encrypt", nargs="?", const=True, default=False, type=str2bool, help="configcenter config")
+    parser.add_argument("--file", help="export/import file")
+    parser.add_argument("--prune", nargs="?", const=True, default=False, type=str2bool, help="sync configcenter delete keys not in config")
+    parser.add_argument("--parallel", type=int, default=0, help="parallel workers, get range scan by split points if > 0")
+    parser.add_argument("--batch", nargs="?", const=True, default=False, type=str2bool, help="put/update rows by batch write row, diff by batch get row without --change")
+    parser.add_argument("--max-parallel", type=int, default=64, help="max parallel writers, writers grow from --parallel while latency is stable")
+    parser.add_argument("--retry", type=int, default=5, help="batch write retry times for failed rows")
+    parser.add_argument("--scan-order", default="ordered", choices=["ordered", "unordered"], help="parallel get range output order")
+    parser.add_argument("--shards", type=int, default=0, help="parallel get range shards, split points are sampled from data, default parallel * 4")
+    parser.add_argument("--columns-to-get", help="get range columns, comma separated")
+    parser.add_argument("--filter", help="get range column filter json format")
+    parser.add_argument("--start-primary-keys", help="get range inclusive start primary keys json format")
+    parser.add_argument("--end-primary-keys", help="get range exclusive end primary keys json format")
+    parser.add_argument("--schema-cache", default="", help="table schema cache file, cache in memory only if empty")
+    parser.add_argument("--schema-cache-ttl", type=int, default=3600, help="table schema cache ttl in seconds")
+    parser.add_argument("--invalidate-schema-cache", nargs="?", const=True, default=False, type=str2bool, help="refetch table schema")
     parser.add_argument("-a", "--action", help="action", choices=[
         "ListTable", "GetRange", "PutRow", "UpdateRow", "GetRow", "CreateTable", "DescribeTable",
-        "GetCanaryDeploy", "PutCanaryDeploy", "DelCanaryDeploy", "GetTask",
-        "GetConfigCenter", "PutConfigCenter", "GetConfigCenterByKey", "PutConfigCenterByKey"
+        "GetCanaryDeploy", "PutCanaryDeploy", "DelCanaryDeploy", "BatchCanaryDeploy", "GetTask",
+        "GetConfigCenter", "PutConfigCenter", "GetConfigCenterByKey", "PutConfigCenterByKey", "SyncConfigCenter",
+        "Export", "Import", "BatchGetTask", "CopyTable"
     ])
     args = parser.parse_args()
     if args.credential:
@@ -327,16 +1265,63 @@ def main():
         args.endpoint = "https://{}.{}.ots.aliyuncs.com".format(args.instance, args.region_id)
     client = tablestore.OTSClient(args.endpoint, args.access_key_id, args.access_key_secret, args.instance)
     kms_cli = AcsClient(args.access_key_id, args.access_key_secret, args.region_id)
+    load_schema_cache(args.schema_cache, args.schema_cache_ttl)
+    if args.invalidate_schema_cache:
+        invalidate_schema_cache(client, args.table)
 
     if args.action == "ListTable":
         print(json.dumps(list_table(client)))
-    elif args.action == "GetRange":
-        for row in get_range(client, args.table):
-            print(json.dumps(row))
+    elif args.action in ("GetRange", "Export", "CopyTable"):
+        filter_spec = json.loads(args.filter) if args.filter else None
+        columns_to_get = None
+        if args.columns_to_get:
+            columns_to_get = args.columns_to_get.split(",")
+            columns_to_get += [col for col in filter_columns(filter_spec) if col not in columns_to_get]
+        column_filter = make_column_filter(filter_spec)
+        start = json.loads(args.start_primary_keys) if args.start_primary_keys else None
+        end = json.loads(args.end_primary_keys) if args.end_primary_keys else None
+        if args.action == "CopyTable":
+            target_instance = args.target_instance or args.instance
+            if not args.target_endpoint:
+                args.target_endpoint = "https://{}.{}.ots.aliyuncs.com".format(target_instance, args.region_id)
+            if args.target_endpoint == args.endpoint and target_instance == args.instance and (args.target_table or args.table) == args.table:
+                parser.error("CopyTable target is the source table, set --target-instance, --target-endpoint or --target-table")
+            target_client = tablestore.OTSClient(args.target_endpoint, args.access_key_id, args.access_key_secret, target_instance)
+            print(json.dumps(copy_table(
+                client, args.table, target_client, args.target_table or args.table, args.parallel or 8, args.shards,
+                make_transform(json.loads(args.transform) if args.transform else None), columns_to_get, column_filter, args.retry,
+                args.max_parallel, start, end
+            )))
+            return
+        if args.action == "Export":
+            print(json.dumps(export_table(client, args.table, args.file, columns_to_get, column_filter, start, end)))
+            return
+        if args.parallel > 0:
+            rows = parallel_get_range(
+                client, args.table, args.parallel, args.scan_order == "ordered", args.shards,
+                columns_to_get, column_filter, start, end
+            )
+        else:
+            rows = get_range(client, args.table, columns_to_get, column_filter, start, end)
+        # 写 stdout 失败时关闭生成器，停止扫描线程
+        with contextlib.closing(rows):
+            for row in rows:
+                sys.stdout.write(json.dumps(row) + "\n")
+    elif args.action == "Import":
+        print(json.dumps(import_table(client, args.table, args.file, args.parallel or 8, args.retry, args.max_parallel)))
     elif args.action == "GetRow":
         row = get_row(client, args.table, json.loads(args.primary_keys))
         if row is not None:
             print(json.dumps(row))
+    elif args.action in ("PutRow", "UpdateRow") and args.batch:
+        rows = iter_rows(args.rows)
+        if args.primary_keys and args.columns:
+            rows = [{"PrimaryKeys": json.loads(args.primary_keys), "Columns": json.loads(args.columns)}]
+        kind = "update" if args.action == "UpdateRow" else "put"
+        if args.change:
+            print(json.dumps(batch_write_rows(client, args.table, rows, kind, max(args.parallel, 1), retry=args.retry, max_parallel=args.max_parallel)))
+        else:
+            print(json.dumps(batch_diff_rows(client, args.table, rows, kind, max(args.parallel, 1), retry=args.retry)))
     elif args.action == "UpdateRow":
         if args.rows:
             if args.rows[0] == "@":
@@ -375,16 +1360,36 @@ def main():
         print(json.dumps(put_canary_deploy(client, args.table, json.loads(args.primary_keys), args.column, json.loads(args.deploy), args.change)))
     elif args.action == "DelCanaryDeploy":
         print(json.dumps(del_canary_deploy(client, args.table, json.loads(args.primary_keys), args.column, json.loads(args.deploy), args.change)))
+    elif args.action == "BatchCanaryDeploy":
+        print(json.dumps(batch_canary_deploy(
+            client, args.table, json.loads(args.primary_keys), args.column,
+            json.loads(args.deploys) if args.deploys else None, json.loads(args.del_deploys) if args.del_deploys else None,
+            args.change, args.retry
+        )))
     elif args.action == "GetTask":
         print(json.dumps(get_task(client, args.table, args.owner, args.project, args.task)))
+    elif args.action == "BatchGetTask":
+        # --task 为逗号分隔的任务 id，@ 开头时从文件读取，没有指定时从标准输入读取，每行一个
+        if args.task and args.task[0] == "@":
+            with open(args.task[1:]) as fp:
+                missing = print_batch_get_task(client, args.table, args.owner, args.project, fp, args.parallel or 8)
+        elif args.task:
+            missing = print_batch_get_task(client, args.table, args.owner, args.project, args.task.split(","), args.parallel or 8)
+        else:
+            missing = print_batch_get_task(client, args.table, args.owner, args.project, sys.stdin, args.parallel or 8)
+        sys.stderr.write(json.dumps({"Missing": missing}) + "\n")
     elif args.action == "CreateTable":
         print(json.dumps(create_table(client, args.table, json.loads(args.meta))))
     elif args.action == "DescribeTable":
         print(json.dumps(describe_table(client, args.table)))
     elif args.action == "GetConfigCenter":
-        print(json.dumps(get_configcenter(client, kms_cli, args.table)))
+        print(json.dumps(get_configcenter(client, kms_cli, args.table, args.parallel or 8)))
     elif args.action == "PutConfigCenter":
         print(json.dumps(put_configcenter(client, args.table, json.loads(args.config), args.change, kms_cli, args.cmkey, args.encrypt)))
+    elif args.action == "SyncConfigCenter":
+        print(json.dumps(sync_configcenter(
+            client, args.table, json.loads(args.config), args.change, kms_cli, args.cmkey, args.encrypt, args.prune, args.parallel or 8
+        )))
     elif args.action == "GetConfigCenterByKey":
         print(json.dumps(get_configcenter_key(client, kms_cli, args.table, args.key)))
     elif args.action == "PutConfigCenterByKey":
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import ots
+import otsfake
+
+
+# 使用 otsfake 中的内存客户端压测 ots.py 的主要路径，每个用例输出一行 json
+# Elapsed 不包含灌数据的时间，Requests 为用例执行期间各接口的请求次数
+# ParallelGetRange 的耗时包含 compute_split_ranges 采样切分点的 GetRange，与真实实例上的路径一致
+# 指定 --baseline 时与之前的输出对比，耗时超过 baseline * (1 + tolerance) 视为性能回退，退出码为 1
+
+
+def task_rows(n):
+    for i in range(n):
+        yield {
+            "PrimaryKeys": {"UPA": "1023210024677934:imm-bench:formatconvert:{:04X}".format(i % 0x10000), "TaskID": "formatconvert-{:08d}".format(i)},
+            "Columns": {"Status": "Succeed", "Progress": 100, "Detail": "x" * 128},
+        }
+
+
+def config_name(i):
+    return "Block{:03d}_Section{:03d}_Key{:07d}".format(i // 10000, i // 100 % 100, i)
+
+
+def canary_deploy(i):
+    version = {
+        "SyncAppName": "IMM_BENCH_APP_CONVERT_{}_sync".format(i),
+        "SyncClusterName": "IMM_BENCH_CLUSTER_CONVERT_{}_sync".format(i),
+        "AsyncAppName": "IMM_BENCH_APP_CONVERT_{}_async".format(i),
+        "AsyncClusterName": "IMM_BENCH_CLUSTER_CONVERT_{}_async".format(i),
+    }
+    return {
+        "ObjectType": "user", "ObjectId": "{:08d}".format(i), "Provider": "WPS", "Function": "CONVERT",
+        "LatestVersion": version, "CanaryDeployVersion": version, "Percent": 100,
+    }
+
+
+def setup_tasks(client, rows, args):
+    ots.create_table(client, "ImmTasks", [["UPA", "STRING"], ["TaskID", "STRING"]])
+    client.load("ImmTasks", task_rows(rows))
+
+
+def bench_get_range(client, rows, args):
+    return sum(1 for _ in ots.get_range(client, "ImmTasks"))
+
+
+def bench_parallel_get_range(client, rows, args):
+    return sum(1 for _ in ots.parallel_get_range(client, "ImmTasks", args.parallel, ordered=False))
+
+
+def setup_put_row(client, rows, args):
+    ots.create_table(client, "ImmTasks", [["UPA", "STRING"], ["TaskID", "STRING"]])
+    with open(args.tmpfile, "w") as fp:
+        for row in task_rows(rows):
+            fp.write(json.dumps(row) + "\n")
+
+
+def bench_put_row(client, rows, args):
+    # 与 cat rows.json | ots.py -a PutRow --batch --change 相同的路径，从 stdin 读取
+    stdin = sys.stdin
+    sys.stdin = open(args.tmpfile)
+    try:
+        res = ots.batch_write_rows(client, "ImmTasks", ots.iter_rows(), "put", args.parallel, retry=args.retry, max_parallel=args.max_parallel)
+    finally:
+        sys.stdin.close()
+        sys.stdin = stdin
+    return res["Rows"] - res["Failed"]
+
+
+def setup_sync_configcenter(client, rows, args):
+    ots.create_table(client, "config_imm_bench", [["Block", "STRING"], ["Section", "STRING"], ["Key", "STRING"]])
+    loads = []
+    for i in range(rows):
+        block, section, key = config_name(i).split("_", 2)
+        loads.append({"PrimaryKeys": {"Block": block, "Section": section, "Key": key}, "Columns": {"Value": "value-{}".format(i)}})
+    client.load("config_imm_bench", loads)
+
+
+def bench_sync_configcenter(client, rows, args):
+    # 每 400 个 key 修改一个，另外新增同样数量的 key
+    config = {config_name(i): "value-{}".format(i) if i % 400 else "changed-{}".format(i) for i in range(rows)}
+    for i in range(rows, rows + rows // 400):
+        config[config_name(i)] = "value-{}".format(i)
+    res = ots.sync_configcenter(client, "config_imm_bench", config, True, None, None, False, parallel=args.parallel)
+    return len(res["Added"]) + len(res["Changed"]) + res["Unchanged"]
+
+
+def setup_canary_deploy(client, rows, args):
+    ots.create_table(client, "IMMConfig", [["Block", "STRING"], ["Section", "STRING"]])
+    client.load("IMMConfig", ({"PrimaryKeys": {"Block": "Block{:07d}".format(i), "Section": "Common"}, "Columns": {"Enable": True}} for i in range(rows)))
+    client.load("IMMConfig", [{
+        "PrimaryKeys": {"Block": "Base", "Section": "Common"},
+        "Columns": {"CanaryDeploy": json.dumps([canary_deploy(i) for i in range(args.deploys)])},
+    }])
+
+
+def bench_canary_deploy(client, rows, args):
+    # 交替新增和删除 deploy，每次编辑都是一次完整的读改写
+    primary_key = {"Block": "Base", "Section": "Common"}
+    for i in range(args.edits):
+        deploy = canary_deploy(args.deploys + i // 2)
+        if i % 2 == 0:
+            ots.put_canary_deploy(client, "IMMConfig", primary_key, "CanaryDeploy", deploy, True)
+        else:
+            ots.del_canary_deploy(client, "IMMConfig", primary_key, "CanaryDeploy", deploy, True)
+    return args.edits
+
+
+def bench_batch_canary_deploy(client, rows, args):
+    # 与 CanaryDeploy 相同的编辑，合并为一次条件更新
+    deploys = [canary_deploy(args.deploys + i) for i in range((args.edits + 1) // 2)]
+    del_deploys = [canary_deploy(i) for i in range(args.edits // 2)]
+    ots.batch_canary_deploy(client, "IMMConfig", {"Block": "Base", "Section": "Common"}, "CanaryDeploy", deploys, del_deploys, True)
+    return args.edits
+
+
+cases = {
+    "GetRange": (setup_tasks, bench_get_range),
+    "ParallelGetRange": (setup_tasks, bench_parallel_get_range),
+    "PutRow": (setup_put_row, bench_put_row),
+    "SyncConfigCenter": (setup_sync_configcenter, bench_sync_configcenter),
+    "CanaryDeploy": (setup_canary_deploy, bench_canary_deploy),
+    "BatchCanaryDeploy": (setup_canary_deploy, bench_batch_canary_deploy),
+}
+
+
+def run_case(case, rows, args):
+    # 每个用例使用独立的客户端和 instance，避免表结构缓存和请求计数互相影响
+    client = otsfake.FakeOTSClient("bench-{}-{}".format(case, rows), args.latency, args.error_rate)
+    setup, bench = cases[case]
+    setup(client, rows, args)
+    before = client.requests.copy()
+    now = time.time()
+    count = bench(client, rows, args)
+    elapsed = time.time() - now
+    return {
+        "Case": case,
+        "Rows": rows,
+        "Count": count,
+        "Elapsed": round(elapsed, 3),
+        "PerSecond": round(count / elapsed, 2) if elapsed > 0 else count,
+        "Requests": dict(client.requests - before),
+    }
+
+
+def load_baseline(filename):
+    baseline = {}
+    if not filename:
+        return baseline
+    with open(filename) as fp:
+        for line in fp:
+            if line.strip():
+                res = json.loads(line)
+                baseline[(res["Case"], res["Rows"])] = res
+    return baseline
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=lambda prog: argparse.RawTextHelpFormatter(prog, width=200), description="""example:
+  python3 otsbench.py > bench.json
+  python3 otsbench.py --rows 10000 --cases GetRange,PutRow --latency 0.002 --parallel 16
+  python3 otsbench.py --rows 10000,100000 --baseline bench.json --tolerance 0.2 2>/dev/null
+""")
+    parser.add_argument("--rows", default="10000,100000,1000000", help="table rows, comma separated")
+    parser.add_argument("--cases", default=",".join(cases), help="benchmark cases, comma separated, choices: {}".format(", ".join(cases)))
+    parser.add_argument("--latency", type=float, default=0, help="injected latency in seconds per request")
+    parser.add_argument("--error-rate", type=float, default=0, help="injected OTSServerBusy rate per row in batch write row")
+    parser.add_argument("--parallel", type=int, default=8, help="parallel workers")
+    parser.add_argument("--max-parallel", type=int, default=64, help="max parallel writers")
+    parser.add_argument("--retry", type=int, default=5, help="batch write retry times for failed rows")
+    parser.add_argument("--deploys", type=int, default=200, help="canary deploys in the edited row")
+    parser.add_argument("--edits", type=int, default=50, help="canary deploy edits")
+    parser.add_argument("--baseline", help="previous output of otsbench.py")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown ratio compared with baseline")
+    args = parser.parse_args()
+    for case in args.cases.split(","):
+        if case not in cases:
+            parser.error("unknown case {}".format(case))
+
+    baseline = load_baseline(args.baseline)
+    regression = False
+    fd, args.tmpfile = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    try:
+        for rows in [int(i) for i in args.rows.split(",")]:
+            for case in args.cases.split(","):
+                res = run_case(case, rows, args)
+                base = baseline.get((case, rows))
+                if base:
+                    res["Baseline"] = base["Elapsed"]
+                    res["Regression"] = res["Elapsed"] > base["Elapsed"] * (1 + args.tolerance)
+                    regression = regression or res["Regression"]
+                print(json.dumps(res), flush=True)
+    finally:
+        os.remove(args.tmpfile)
+    if regression:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
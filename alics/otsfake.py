@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+import bisect
+import collections
+import random
+import threading
+import time
+import tablestore
+
+
+# 进程内的 OTSClient 替身，数据保存在内存中，用于在没有 Tablestore 实例时压测 ots.py
+# latency 为每次请求注入的延迟（秒），error_rate 为批量写中每行返回 OTSServerBusy 的概率
+# 只实现了 ots.py 用到的接口，返回值使用 SDK 自己的类型，调用方无需区分真假客户端
+
+
+comparators = {
+    tablestore.ComparatorType.EQUAL: lambda a, b: a == b,
+    tablestore.ComparatorType.NOT_EQUAL: lambda a, b: a != b,
+    tablestore.ComparatorType.GREATER_THAN: lambda a, b: a > b,
+    tablestore.ComparatorType.GREATER_EQUAL: lambda a, b: a >= b,
+    tablestore.ComparatorType.LESS_THAN: lambda a, b: a < b,
+    tablestore.ComparatorType.LESS_EQUAL: lambda a, b: a <= b,
+}
+
+
+def encode_key(pks):
+    # INF_MIN < 任意值 < INF_MAX，转换成元组后可以直接排序和二分查找
+    # SDK 返回的 BINARY 主键为 bytearray，不能作为 dict 的 key，转换成 bytes
+    res = []
+    for _, val in pks:
+        if val is tablestore.INF_MIN:
+            res.append((0,))
+        elif val is tablestore.INF_MAX:
+            res.append((2,))
+        elif isinstance(val, bytearray):
+            res.append((1, bytes(val)))
+        else:
+            res.append((1, val))
+    return tuple(res)
+
+
+def check_column_condition(cond, columns):
+    if cond is None:
+        return True
+    if isinstance(cond, tablestore.CompositeColumnCondition):
+        results = [check_column_condition(sub, columns) for sub in cond.sub_conditions]
+        if cond.combinator == tablestore.LogicalOperator.NOT:
+            return not results[0]
+        if cond.combinator == tablestore.LogicalOperator.AND:
+            return all(results)
+        return any(results)
+    if cond.column_name not in columns:
+        return cond.pass_if_missing
+    try:
+        return comparators[cond.comparator](columns[cond.column_name], cond.column_value)
+    except TypeError:
+        return False
+
+
+def check_condition(condition, columns):
+    # columns 为 None 表示行不存在，注意 Condition.get_column_condition 在 SDK 中没有返回值，这里直接读属性
+    if condition is None:
+        return True
+    expect = condition.row_existence_expectation
+    if expect == tablestore.RowExistenceExpectation.EXPECT_EXIST and columns is None:
+        return False
+    if expect == tablestore.RowExistenceExpectation.EXPECT_NOT_EXIST and columns is not None:
+        return False
+    if condition.column_condition is not None:
+        return columns is not None and check_column_condition(condition.column_condition, columns)
+    return True
+
+
+class FakeOTSClient(object):
+    def __init__(self, instance_name="fake", latency=0, error_rate=0, page_size=5000):
+        self.instance_name = instance_name
+        self.latency = latency
+        self.error_rate = error_rate
+        self.page_size = page_size
+        self.tables = {}
+        self.requests = collections.Counter()
+        self.lock = threading.Lock()
+
+    def request(self, action):
+        with self.lock:
+            self.requests[action] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def table(self, table_name):
+        if table_name not in self.tables:
+            raise tablestore.OTSServiceError(404, "OTSObjectNotExist", "Requested table does not exist.")
+        return self.tables[table_name]
+
+    def sorted_keys(self, table):
+        # 新增或删除行后排序结果失效，下次范围读时重建
+        if table["index"] is None:
+            table["index"] = sorted(table["rows"])
+        return table["index"]
+
+    def make_row(self, pks, columns, columns_to_get=None):
+        names = sorted(columns) if not columns_to_get else [col for col in sorted(columns) if col in columns_to_get]
+        return tablestore.Row(list(pks), [(name, columns[name], 0) for name in names])
+
+    def load(self, table_name, rows):
+        # 不经过请求直接灌入数据，rows 为 ots.py 格式的 {"PrimaryKeys": {}, "Columns": {}}
+        table = self.table(table_name)
+        keys = [pk[0] for pk in table["meta"].schema_of_primary_key]
+        with self.lock:
+            for row in rows:
+                pks = [(key, row["PrimaryKeys"][key]) for key in keys]
+                table["rows"][encode_key(pks)] = (pks, dict(row["Columns"]))
+            table["index"] = None
+
+    def create_table(self, table_meta, table_options, reserved_throughput, secondary_indexes=None):
+        self.request("CreateTable")
+        with self.lock:
+            if table_meta.table_name in self.tables:
+                raise tablestore.OTSServiceError(409, "OTSObjectAlreadyExist", "Requested table already exists.")
+            self.tables[table_meta.table_name] = {
+                "meta": table_meta,
+                "options": table_options,
+                "rows": {},
+                "index": None,
+            }
+
+    def list_table(self):
+        self.request("ListTable")
+        return tuple(sorted(self.tables))
+
+    def describe_table(self, table_name):
+        self.request("DescribeTable")
+        table = self.table(table_name)
+        return tablestore.DescribeTableResponse(
+            table["meta"], table["options"],
+            tablestore.ReservedThroughputDetails(tablestore.CapacityUnit(0, 0), None, None)
+        )
+
+    def get_row(self, table_name, primary_key, columns_to_get=None, column_filter=None, max_version=None, **kwargs):
+        self.request("GetRow")
+        table = self.table(table_name)
+        with self.lock:
+            row = table["rows"].get(encode_key(primary_key))
+        if row is None or not check_column_condition(column_filter, row[1]):
+            return tablestore.CapacityUnit(1, 0), None, None
+        return tablestore.CapacityUnit(1, 0), self.make_row(row[0], row[1], columns_to_get), None
+
+    def write(self, table, kind, row, condition):
+        key = encode_key(row.primary_key)
+        with self.lock:
+            old = table["rows"].get(key)
+            if not check_condition(condition, old[1] if old is not None else None):
+                raise tablestore.OTSServiceError(403, "OTSConditionCheckFail", "Condition check failed.")
+            if kind == "delete":
+                if table["rows"].pop(key, None) is not None:
+                    table["index"] = None
+                return
+            if kind == "put":
+                columns = {col[0]: col[1] for col in row.attribute_columns or []}
+            else:
+                columns = dict(old[1]) if old is not None else {}
+                for op, cols in (row.attribute_columns or {}).items():
+                    op = op.upper()
+                    for col in cols:
+                        if op == "PUT":
+                            columns[col[0]] = col[1]
+                        else:
+                            columns.pop(col if isinstance(col, str) else col[0], None)
+            if old is None:
+                table["index"] = None
+            table["rows"][key] = (list(row.primary_key), columns)
+
+    def put_row(self, table_name, row, condition=None, return_type=None, transaction_id=None):
+        self.request("PutRow")
+        self.write(self.table(table_name), "put", row, condition)
+        return tablestore.CapacityUnit(0, 1), None
+
+    def update_row(self, table_name, row, condition, return_type=None, transaction_id=None):
+        self.request("UpdateRow")
+        self.write(self.table(table_name), "update", row, condition)
+        return tablestore.CapacityUnit(0, 1), None
+
+    def delete_row(self, table_name, row, condition, return_type=None, transaction_id=None):
+        self.request("DeleteRow")
+        self.write(self.table(table_name), "delete", row, condition)
+        return tablestore.CapacityUnit(0, 1), None
+
+    def get_range(self, table_name, direction, inclusive_start_primary_key, exclusive_end_primary_key,
+                  columns_to_get=None, limit=None, column_filter=None, max_version=None, **kwargs):
+        # 与服务端一致，每页最多扫描 page_size 行，过滤在扫描之后进行，因此可能返回空页和下一页的起始主键
+        # BACKWARD 时 start 为较大的主键，从 start 开始逆序扫描到 end（不含）
+        self.request("GetRange")
+        table = self.table(table_name)
+        size = min(limit, self.page_size) if limit else self.page_size
+        with self.lock:
+            index = self.sorted_keys(table)
+            if direction == tablestore.Direction.FORWARD:
+                lo = bisect.bisect_left(index, encode_key(inclusive_start_primary_key))
+                hi = bisect.bisect_left(index, encode_key(exclusive_end_primary_key))
+                keys = index[lo:min(hi, lo + size)]
+                next_key = index[lo + size] if lo + size < hi else None
+            else:
+                hi = bisect.bisect_right(index, encode_key(inclusive_start_primary_key))
+                lo = bisect.bisect_right(index, encode_key(exclusive_end_primary_key))
+                keys = index[max(lo, hi - size):hi][::-1]
+                next_key = index[hi - size - 1] if hi - size > lo else None
+            rows = [table["rows"][key] for key in keys]
+            next_start = table["rows"][next_key][0] if next_key is not None else None
+        rows = [self.make_row(pks, columns, columns_to_get) for pks, columns in rows if check_column_condition(column_filter, columns)]
+        return tablestore.CapacityUnit(len(keys), 0), next_start, rows, None
+
+    def batch_get_row(self, request):
+        self.request("BatchGetRow")
+        if sum(len(item.primary_keys) for item in request.items.values()) > 100:
+            raise tablestore.OTSServiceError(400, "OTSParameterInvalid", "Rows count exceeds the upper limit: 100.")
+        res = []
+        for table_name, item in request.items.items():
+            table = self.table(table_name)
+            items = []
+            with self.lock:
+                for pks in item.primary_keys:
+                    row = table["rows"].get(encode_key(pks))
+                    if row is None or not check_column_condition(item.column_filter, row[1]):
+                        items.append(tablestore.RowDataItem(True, "", "", table_name, tablestore.CapacityUnit(1, 0), None, None))
+                        continue
+                    row = self.make_row(row[0], row[1], item.columns_to_get)
+                    items.append(tablestore.RowDataItem(
+                        True, "", "", table_name, tablestore.CapacityUnit(1, 0), row.primary_key, row.attribute_columns
+                    ))
+            res.append(items)
+        return tablestore.BatchGetRowResponse(res)
+
+    def batch_write_row(self, request):
+        self.request("BatchWriteRow")
+        if sum(len(item.row_items) for item in request.items.values()) > 200:
+            raise tablestore.OTSServiceError(400, "OTSParameterInvalid", "Rows count exceeds the upper limit: 200.")
+        res = {}
+        for table_name, item in request.items.items():
+            table = self.table(table_name)
+            res[table_name] = []
+            for row_item in item.row_items:
+                if self.error_rate and random.random() < self.error_rate:
+                    res[table_name].append(tablestore.BatchWriteRowResponseItem(
+                        False, "OTSServerBusy", "Server is busy.", None, row_item.row.primary_key
+                    ))
+                    continue
+                try:
+                    self.write(table, row_item.type, row_item.row, row_item.condition)
+                except tablestore.OTSServiceError as e:
+                    res[table_name].append(tablestore.BatchWriteRowResponseItem(
+                        False, e.get_error_code(), e.get_error_message(), None, row_item.row.primary_key
+                    ))
+                    continue
+                res[table_name].append(tablestore.BatchWriteRowResponseItem(
+                    True, "", "", tablestore.CapacityUnit(0, 1), row_item.row.primary_key
+                ))
+        return tablestore.BatchWriteRowResponse(request, res)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Describe* 接口共用的分页
+# 使用接口允许的最大 PageSize，先请求第一页拿到 TotalCount，再并发请求剩余的页，按页码顺序合并结果
+# 大账号下的列表只需要一到两次往返
+
+
+options = {
+    "parallel": 8,
+}
+
+
+def configure(parallel=None):
+    if parallel is not None:
+        options["parallel"] = parallel
+
+
+def copy_request(req, page_number):
+    # Tea 的请求模型通过 to_map/from_map 复制，每页使用独立的请求对象
+    page = type(req)().from_map(req.to_map())
+    page.page_number = page_number
+    return page
+
+
+def items_of(body, path):
+    for key in path:
+        body = body[key]
+    return body
+
+
+def fetch_all(describe, req, path, page_size, total="TotalCount", max_pages=None, parallel=None):
+    # describe 为 SDK 客户端的方法，path 为结果列表在 body 中的路径，如 ["Instances", "Instance"]
+    # total 为总数字段，不同产品不一样（RDS 为 TotalRecordCount），max_pages 限制最多请求的页数
+    req.page_size = page_size
+    req.page_number = 1
+    body = describe(req).to_map()["body"]
+    items = list(items_of(body, path))
+    pages = (body.get(total, 0) + page_size - 1) // page_size
+    if max_pages:
+        pages = min(pages, max_pages)
+    if pages <= 1:
+        return items
+
+    def fetch(page_number):
+        return items_of(describe(copy_request(req, page_number)).to_map()["body"], path)
+
+    with ThreadPoolExecutor(max_workers=min(parallel or options["parallel"], pages - 1)) as executor:
+        for page in executor.map(fetch, range(2, pages + 1)):
+            items.extend(page)
+    return items
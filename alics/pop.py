@@ -1,67 +1,50 @@
 #!/usr/bin/env python3
 
 import argparse
-import base64
-import datetime
-import hmac
 import json
-import random
-import urllib
-import requests
+import sys
 import aksk
-
-
-def encode(message):
-    return urllib.parse.quote(str(message), safe='', encoding="utf-8").replace("+", "%20").replace("*", "%2A").replace("%7E", "~")
-
-
-def signature(methods, params, access_key_secret):
-    kvs = "&".join([
-        "{}={}".format(encode(i), encode(params[i])) for i in sorted(params)
-    ])
-    to_sign = methods + "&" + encode("/") + "&" + "" + encode(kvs)
-    return base64.b64encode(hmac.new((access_key_secret + '&').encode(), to_sign.encode(), digestmod='sha1').digest()).decode()
-
-
-def make_pop_params(methods, params, access_key_id, access_key_secret):
-    params["AccessKeyId"] = access_key_id
-    if "Format" not in params:
-        params["Format"] = "JSON"
-    if "Version" not in params:
-        params["Version"] = "2017-09-06"
-    if "Timestamp" not in params:
-        params["Timestamp"] = datetime.datetime.utcnow().isoformat()
-    if "SignatureMethod" not in params:
-        params["SignatureMethod"] = "HMAC-SHA1"
-    if "SignatureVersion" not in params:
-        params["SignatureVersion"] = "1.0"
-    if "SignatureNonce" not in params:
-        params["SignatureNonce"] = random.randint(0, 2**63-1)
-    params["Signature"] = signature(methods, params, access_key_secret)
-    return params
-
-
-def assume_role(endpoint, access_key_id, access_key_secret, owner_id, role):
-    # https://help.aliyun.com/document_detail/28763.html?spm=a2c4g.11186623.6.805.78927ffb2YnPpi
-    params = {
-        "Action": "AssumeRole",
-        "Version": "2015-04-01",
-        "RoleArn": "acs:ram::{}:role/{}".format(owner_id, role),
-        "RoleSessionName": "test",
-        "DurationSeconds": 3600,
-    }
-    params = make_pop_params("POST", params, access_key_id, access_key_secret)
-
-    res = requests.post(endpoint, params=params)
-    return json.loads(res.text)
-
-
-def do(endpoint, params, access_key_id, access_key_secret, security_token):
-    if security_token:
-        params["SecurityToken"] = security_token
-    params = make_pop_params("POST", params, access_key_id, access_key_secret)
-    res = requests.post(endpoint, params=params)
-    return json.loads(res.text)
+import popclient
+import retry
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+def batch_do(endpoint, lines, access_key_id, access_key_secret, security_token, parallel=8, ordered=False):
+    # lines 中每行一个 json 请求，返回 {"Line": 行号, "Response": 响应} 或 {"Line": 行号, "Error": 错误}
+    # 最多 parallel * 2 个请求在途，ordered 时按输入顺序返回，否则按完成顺序返回
+    def work(lineno, line):
+        try:
+            return {"Line": lineno, "Response": popclient.do(endpoint, json.loads(line), access_key_id, access_key_secret, security_token)}
+        except Exception as e:
+            return {"Line": lineno, "Error": "{}: {}".format(type(e).__name__, e)}
+
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        futures = []
+        for lineno, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            if len(futures) >= parallel * 2:
+                if ordered:
+                    yield futures.pop(0).result()
+                else:
+                    done, pending = wait(futures, return_when=FIRST_COMPLETED)
+                    futures = [future for future in futures if future in pending]
+                    for future in done:
+                        yield future.result()
+            futures.append(executor.submit(work, lineno, line))
+        for future in futures:
+            yield future.result()
+
+
+def str2bool(v):
+    if isinstance(v, bool):
+        return v
+    if v.lower() in ('yes', 'true', 't', 'y', '1'):
+        return True
+    elif v.lower() in ('no', 'false', 'f', 'n', '0'):
+        return False
+    else:
+        raise argparse.ArgumentTypeError('Boolean value expected.')
 
 
 def main():
@@ -85,6 +68,8 @@ def main():
     "FileID": "1234",
     "Version": "2017-09-06"
   }'
+  cat requests.json | python3 pop.py -c ~/.aksk/imm-test -e https://imm.cn-shanghai.aliyuncs.com --batch --parallel 16 --retry 3 --read-timeout 10
+  cat requests.json | python3 pop.py -c ~/.aksk/imm-test -e https://imm.cn-shanghai.aliyuncs.com --batch --ordered > responses.json
 """)
     parser.add_argument("-c", "--credential", help="credential file")
     parser.add_argument("-i", "--access-key-id", help="access key id")
@@ -92,21 +77,44 @@ def main():
     parser.add_argument("-e", "--endpoint", required=True, help="endpoint")
     parser.add_argument("--role", help="role")
     parser.add_argument("--owner-id", help="user id")
+    parser.add_argument("--sts-cache", default="~/.alics/sts.json", help="assume role credential cache file, disable cache if empty")
     parser.add_argument("--request", help="request")
+    parser.add_argument("--pool-size", type=int, default=10, help="http connection pool size")
+    parser.add_argument("--connect-timeout", type=float, default=5, help="http connect timeout in seconds")
+    parser.add_argument("--read-timeout", type=float, default=60, help="http read timeout in seconds")
+    parser.add_argument("--batch", nargs="?", const=True, default=False, type=str2bool, help="read ndjson requests from stdin, write ndjson responses tagged with line number")
+    parser.add_argument("--parallel", type=int, default=8, help="batch mode parallel requests")
+    parser.add_argument("--ordered", nargs="?", const=True, default=False, type=str2bool, help="batch mode output in input order")
+    parser.add_argument("--retry", type=int, default=3, help="retry times for network errors, throttling and service unavailable")
+    parser.add_argument("--rate-limit", type=float, default=0, help="max requests per second, no limit if 0")
+    parser.add_argument("--retry-metrics", nargs="?", const=True, default=False, type=str2bool, help="print retry metrics to stderr")
     args = parser.parse_args()
+    retry.configure(retry=args.retry)
+    retry.set_rate_limit(popclient.product(args.endpoint), args.rate_limit)
+    popclient.configure(max(args.pool_size, args.parallel if args.batch else 0), args.connect_timeout, args.read_timeout)
 
     if args.credential:
         args.access_key_id, args.access_key_secret = aksk.load_from_file(args.credential)
 
     security_token = ''
     if args.owner_id and args.role:
-        res = assume_role("https://sts.aliyuncs.com", args.access_key_id, args.access_key_secret, args.owner_id, args.role)
+        res = popclient.cached_assume_role(
+            "https://sts.aliyuncs.com", args.access_key_id, args.access_key_secret, args.owner_id, args.role, args.sts_cache
+        )
         args.access_key_id = res["Credentials"]["AccessKeyId"]
         args.access_key_secret = res["Credentials"]["AccessKeySecret"]
         security_token = res["Credentials"]["SecurityToken"]
 
-    request = json.loads(args.request)
-    print(json.dumps(do(args.endpoint, request, args.access_key_id, args.access_key_secret, security_token)))
+    if args.batch:
+        for res in batch_do(
+            args.endpoint, sys.stdin, args.access_key_id, args.access_key_secret, security_token, args.parallel, args.ordered
+        ):
+            sys.stdout.write(json.dumps(res) + "\n")
+    else:
+        request = json.loads(args.request)
+        print(json.dumps(popclient.do(args.endpoint, request, args.access_key_id, args.access_key_secret, security_token)))
+    if args.retry_metrics:
+        sys.stderr.write(json.dumps(retry.stat()) + "\n")
 
 
 if __name__ == "__main__":
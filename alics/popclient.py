@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+import base64
+import datetime
+import fcntl
+import hashlib
+import hmac
+import json
+import os
+import random
+import threading
+import urllib.parse
+import requests
+import retry
+from requests.adapters import HTTPAdapter
+
+
+# pop.py 和 imm.py 共用的 POP 签名和请求
+# 所有请求复用同一个带连接池的 Session，keep-alive 连接只在第一次请求时握手
+
+
+options = {
+    "pool_size": 10,
+    "connect_timeout": 5,
+    "read_timeout": 60,
+}
+session = None
+session_lock = threading.Lock()
+
+
+def configure(pool_size=None, connect_timeout=None, read_timeout=None):
+    # 修改连接池配置后，下一次请求时重建 Session
+    global session
+    with session_lock:
+        for key, val in (("pool_size", pool_size), ("connect_timeout", connect_timeout), ("read_timeout", read_timeout)):
+            if val is not None:
+                options[key] = val
+        if session is not None:
+            session.close()
+            session = None
+
+
+def get_session():
+    global session
+    with session_lock:
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=options["pool_size"], pool_maxsize=options["pool_size"])
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+        return session
+
+
+def timeout():
+    return options["connect_timeout"], options["read_timeout"]
+
+
+def encode(message):
+    # RFC 3986 编码，python3.7 之后 quote 不再编码 "~"，空格编码为 %20，"*" 编码为 %2A，与 POP 的要求一致
+    return urllib.parse.quote(str(message), safe="~")
+
+
+# 按 AccessKeySecret 缓存初始化好的 hmac 对象，每次签名只需 copy
+signers = {}
+
+
+def signature(methods, params, access_key_secret):
+    signer = signers.get(access_key_secret)
+    if signer is None:
+        signer = signers[access_key_secret] = hmac.new((access_key_secret + '&').encode(), digestmod=hashlib.sha1)
+    kvs = "&".join(["{}={}".format(encode(i), encode(params[i])) for i in sorted(params)])
+    signer = signer.copy()
+    signer.update("{}&%2F&{}".format(methods, encode(kvs)).encode())
+    return base64.b64encode(signer.digest()).decode()
+
+
+def make_pop_params(methods, params, access_key_id, access_key_secret):
+    params["AccessKeyId"] = access_key_id
+    params.setdefault("Format", "JSON")
+    params.setdefault("Version", "2017-09-06")
+    params.setdefault("Timestamp", datetime.datetime.utcnow().isoformat())
+    params.setdefault("SignatureMethod", "HMAC-SHA1")
+    params.setdefault("SignatureVersion", "1.0")
+    params.setdefault("SignatureNonce", random.randint(0, 2**63-1))
+    params["Signature"] = signature(methods, params, access_key_secret)
+    return params
+
+
+def assume_role(endpoint, access_key_id, access_key_secret, owner_id, role):
+    # https://help.aliyun.com/document_detail/28763.html?spm=a2c4g.11186623.6.805.78927ffb2YnPpi
+    params = {
+        "Action": "AssumeRole",
+        "Version": "2015-04-01",
+        "RoleArn": "acs:ram::{}:role/{}".format(owner_id, role),
+        "RoleSessionName": "test",
+        "DurationSeconds": 3600,
+    }
+    return send(endpoint, params, access_key_id, access_key_secret)
+
+
+def sts_expiration(res):
+    return datetime.datetime.strptime(res["Credentials"]["Expiration"], "%Y-%m-%dT%H:%M:%SZ")
+
+
+# STS 临时凭证缓存，key 为 "AccessKeyId/OwnerId/Role"，文件权限 0600
+# 多个进程同时运行时通过 <file>.lock 上的文件锁串行化，只有一个进程调用 AssumeRole，其他进程读取它写入的结果
+# 凭证在过期前 refresh_before 秒主动刷新，避免拿到即将过期的凭证
+def cached_assume_role(endpoint, access_key_id, access_key_secret, owner_id, role, filename="~/.alics/sts.json", refresh_before=600):
+    if not filename:
+        return assume_role(endpoint, access_key_id, access_key_secret, owner_id, role)
+    filename = os.path.expanduser(filename)
+    os.makedirs(os.path.dirname(filename) or ".", mode=0o700, exist_ok=True)
+    key = "{}/{}/{}".format(access_key_id, owner_id, role)
+    fd = os.open(filename + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        cache = {}
+        if os.path.exists(filename):
+            try:
+                with open(filename) as fp:
+                    cache = json.load(fp)
+            except ValueError:
+                cache = {}
+        item = cache.get(key)
+        if item and (sts_expiration(item) - datetime.datetime.utcnow()).total_seconds() > refresh_before:
+            return item
+        res = assume_role(endpoint, access_key_id, access_key_secret, owner_id, role)
+        if "Credentials" not in res:
+            return res
+        now = datetime.datetime.utcnow()
+        for k in list(cache):
+            if sts_expiration(cache[k]) <= now:
+                del cache[k]
+        cache[key] = res
+        tmp = "{}.{}.tmp".format(filename, os.getpid())
+        with os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as fp:
+            json.dump(cache, fp)
+        os.replace(tmp, filename)
+        return res
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def response_code(res):
+    return res.get("Code") if isinstance(res, dict) else None
+
+
+def product(endpoint):
+    # 按 endpoint 的域名统计重试和限速
+    return urllib.parse.urlparse(endpoint).hostname
+
+
+def send(endpoint, params, access_key_id, access_key_secret):
+    # 每次重试使用新的副本重新签名，SignatureNonce 不能重复
+    def post(params):
+        res = get_session().post(endpoint, params=make_pop_params("POST", dict(params), access_key_id, access_key_secret), timeout=timeout())
+        return json.loads(res.text)
+    return retry.call(product(endpoint), post, params, check=response_code, action=params.get("Action"))
+
+
+def do(endpoint, params, access_key_id, access_key_secret, security_token):
+    if security_token:
+        params["SecurityToken"] = security_token
+    return send(endpoint, params, access_key_id, access_key_secret)
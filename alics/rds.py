@@ -3,43 +3,50 @@
 import argparse
 import json
 import aksk
+import inventory
+import paginate
+import regions
+import retry
 
 from alibabacloud_rds20140815.client import Client as Rds20140815Client
 from alibabacloud_tea_openapi import models as open_api_models
 from alibabacloud_rds20140815 import models as rds_20140815_models
 
 
+def str2bool(v):
+    if isinstance(v, bool):
+        return v
+    if v.lower() in ('yes', 'true', 't', 'y', '1'):
+        return True
+    elif v.lower() in ('no', 'false', 'f', 'n', '0'):
+        return False
+    else:
+        raise argparse.ArgumentTypeError('Boolean value expected.')
+
+
 def describe_db_instances(config: open_api_models.Config, region_id):
     req = rds_20140815_models.DescribeDBInstancesRequest()
     req.region_id = region_id
-    instances = []
-    while True:
-        res = Rds20140815Client(config).describe_dbinstances(req)
-        res = res.to_map()
-        for instance in res["body"]["Items"]["DBInstance"]:
-            instances.append(instance)
-        if len(instances) >= res["body"]["TotalRecordCount"]:
-            break
-        req.page_number = res["body"]["PageNumber"] + 1
-    return instances
+    client = retry.wrap("rds", Rds20140815Client(config))
+    return paginate.fetch_all(client.describe_dbinstances, req, ["Items", "DBInstance"], 100, total="TotalRecordCount")
 
 
 def describe_db_instance_attribute(config: open_api_models.Config, region_id, instance_id, instance_name):
     if not instance_id:
-        instances = describe_db_instances(config, region_id)
-        for instance in instances:
-            if instance["DBInstanceDescription"] == instance_name:
-                instance_id = instance["DBInstanceId"]
-                break
+        instance = inventory.find_one("rds", inventory.config_scope(config, region_id), lambda: describe_db_instances(config, region_id), name=instance_name)
+        if instance:
+            instance_id = instance["DBInstanceId"]
     req = rds_20140815_models.DescribeDBInstanceAttributeRequest()
     req.dbinstance_id = instance_id
-    res = Rds20140815Client(config).describe_dbinstance_attribute(req)
+    res = retry.wrap("rds", Rds20140815Client(config)).describe_dbinstance_attribute(req)
     return res.to_map()["body"]["Items"]["DBInstanceAttribute"][0]
 
 
 def main():
     parser = argparse.ArgumentParser(formatter_class=lambda prog: argparse.RawTextHelpFormatter(prog, width=200), description="""example:
   python3 rds.py -i ak -s sk -r cn-shanghai -a DescribeDBInstances
+  python3 rds.py -i ak -s sk -r cn-shanghai -a DescribeDBInstances --all-regions
+  python3 rds.py -i ak -s sk -r cn-shanghai -a DescribeDBInstances --all-regions --changes
   python3 rds.py -i ak -s sk -r cn-shanghai -a DescribeDBInstanceAttribute --instance-id rm-uf6x9546140uj8rnv
   python3 rds.py -i ak -s sk -r cn-shanghai -a DescribeDBInstanceAttribute --instance-name weboffice-regression-rds
 """)
@@ -50,7 +57,13 @@ def main():
     parser.add_argument("-c", "--credential", help="credential file")
     parser.add_argument("--instance-id", help="instance id")
     parser.add_argument("--instance-name", help="instance name")
+    parser.add_argument("--all-regions", nargs="?", const=True, default=False, type=str2bool, help="describe in all regions concurrently, region id is set in each result")
+    parser.add_argument("--region-parallel", type=int, default=8, help="max regions described concurrently")
+    parser.add_argument("--changes", nargs="?", const=True, default=False, type=str2bool, help="print added/removed/modified resources since last run as ndjson")
+    parser.add_argument("--inventory", default="~/.alics/inventory.db", help="local resource index for name lookups, disabled if empty")
+    parser.add_argument("--inventory-ttl", type=int, default=600, help="resync resource index after seconds")
     args = parser.parse_args()
+    inventory.configure(filename=args.inventory, ttl=args.inventory_ttl)
     if args.credential:
         args.access_key_id, args.access_key_secret = aksk.load_from_file(args.credential)
     config = open_api_models.Config(
@@ -59,7 +72,7 @@ def main():
         region_id=args.region_id,
     )
     if args.action == "DescribeDBInstances":
-        print(json.dumps(describe_db_instances(config, args.region_id)))
+        regions.print_describe(config, args.region_id, "rds", describe_db_instances, all_regions=args.all_regions, changes=args.changes, parallel=args.region_parallel)
     elif args.action == "DescribeDBInstanceAttribute":
         print(json.dumps(describe_db_instance_attribute(config, args.region_id, args.instance_id, args.instance_name)))
     else:
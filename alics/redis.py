@@ -3,43 +3,50 @@
 import argparse
 import json
 import aksk
+import inventory
+import paginate
+import regions
+import retry
 
 from alibabacloud_r_kvstore20150101.client import Client as R_kvstore20150101Client
 from alibabacloud_tea_openapi import models as open_api_models
 from alibabacloud_r_kvstore20150101 import models as r_kvstore_20150101_models
 
 
+def str2bool(v):
+    if isinstance(v, bool):
+        return v
+    if v.lower() in ('yes', 'true', 't', 'y', '1'):
+        return True
+    elif v.lower() in ('no', 'false', 'f', 'n', '0'):
+        return False
+    else:
+        raise argparse.ArgumentTypeError('Boolean value expected.')
+
+
 def describe_instances(config: open_api_models.Config, region_id):
     req = r_kvstore_20150101_models.DescribeInstancesRequest()
     req.region_id = region_id
-    instances = []
-    while True:
-        res = R_kvstore20150101Client(config).describe_instances(req)
-        res = res.to_map()["body"]
-        for instance in res["Instances"]["KVStoreInstance"]:
-            instances.append(instance)
-        if len(instances) >= res["TotalCount"]:
-            break
-        req.page_number = res["PageNumber"] + 1
-    return instances
+    client = retry.wrap("redis", R_kvstore20150101Client(config))
+    return paginate.fetch_all(client.describe_instances, req, ["Instances", "KVStoreInstance"], 50)
 
 
 def describe_instance_attribute(config: open_api_models.Config, region_id, instance_id, instance_name):
     req = r_kvstore_20150101_models.DescribeInstanceAttributeRequest()
     if not instance_id:
-        instances = describe_instances(config, region_id)
-        for instance in instances:
-            if instance["InstanceName"] == instance_name:
-                instance_id = instance["InstanceId"]
-                break
+        instance = inventory.find_one("redis", inventory.config_scope(config, region_id), lambda: describe_instances(config, region_id), name=instance_name)
+        if instance:
+            instance_id = instance["InstanceId"]
     req.instance_id = instance_id
-    res = R_kvstore20150101Client(config).describe_instance_attribute(req)
+    res = retry.wrap("redis", R_kvstore20150101Client(config)).describe_instance_attribute(req)
     return res.to_map()["body"]["Instances"]["DBInstanceAttribute"][0]
 
 
 def main():
     parser = argparse.ArgumentParser(formatter_class=lambda prog: argparse.RawTextHelpFormatter(prog, width=200), description="""example:
   python3 redis.py -i ak -s sk -r cn-shanghai -a DescribeInstances
+  python3 redis.py -i ak -s sk -r cn-shanghai -a DescribeInstances --all-regions
+  python3 redis.py -i ak -s sk -r cn-shanghai -a DescribeInstances --changes
   python3 redis.py -i ak -s sk -r cn-shanghai -a DescribeInstanceAttribute --instance-name weboffice-regression-redis
 """)
     parser.add_argument("-i", "--access-key-id", help="access key id")
@@ -49,7 +56,13 @@ def main():
     parser.add_argument("-c", "--credential", help="credential file")
     parser.add_argument("--instance-id", help="instance id")
     parser.add_argument("--instance-name", help="instance name")
+    parser.add_argument("--all-regions", nargs="?", const=True, default=False, type=str2bool, help="describe in all regions concurrently, region id is set in each result")
+    parser.add_argument("--region-parallel", type=int, default=8, help="max regions described concurrently")
+    parser.add_argument("--changes", nargs="?", const=True, default=False, type=str2bool, help="print added/removed/modified resources since last run as ndjson")
+    parser.add_argument("--inventory", default="~/.alics/inventory.db", help="local resource index for name lookups, disabled if empty")
+    parser.add_argument("--inventory-ttl", type=int, default=600, help="resync resource index after seconds")
     args = parser.parse_args()
+    inventory.configure(filename=args.inventory, ttl=args.inventory_ttl)
     if args.credential:
         args.access_key_id, args.access_key_secret = aksk.load_from_file(args.credential)
     config = open_api_models.Config(
@@ -59,7 +72,7 @@ def main():
     )
 
     if args.action == "DescribeInstances":
-        print(json.dumps(describe_instances(config, args.region_id)))
+        regions.print_describe(config, args.region_id, "redis", describe_instances, all_regions=args.all_regions, changes=args.changes, parallel=args.region_parallel)
     elif args.action == "DescribeInstanceAttribute":
         print(json.dumps(describe_instance_attribute(config, args.region_id, args.instance_id, args.instance_name)))
     else:
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+import json
+import sys
+import inventory
+import retry
+from concurrent.futures import ThreadPoolExecutor
+
+from alibabacloud_ecs20140526.client import Client as Ecs20140526Client
+from alibabacloud_tea_openapi import models as open_api_models
+from alibabacloud_ecs20140526 import models as ecs_20140526_models
+
+
+# 所有地域并发执行 Describe* 查询，合并结果，每条结果的 RegionId 设为查询的地域
+# 线程池大小为 parallel，某个地域失败时不影响其他地域，失败的地域和错误信息写到 stderr
+# 输出变化时每个地域单独保存快照，查询失败的地域不输出变化，避免把它的资源当成删除
+
+
+def describe_region_ids(config: open_api_models.Config):
+    # 没有指定地域时通过杭州查询地域列表
+    req = ecs_20140526_models.DescribeRegionsRequest()
+    res = retry.wrap("ecs", Ecs20140526Client(region_config(config, config.region_id or "cn-hangzhou"))).describe_regions(req)
+    return [x["RegionId"] for x in res.to_map()["body"]["Regions"]["Region"]]
+
+
+def region_config(config: open_api_models.Config, region_id):
+    # 每个地域使用独立的 config，SDK 根据 region_id 选择 endpoint
+    res = open_api_models.Config().from_map(config.to_map())
+    res.region_id = region_id
+    return res
+
+
+def fan_out(config: open_api_models.Config, describe, *args, region_ids=None, parallel=8):
+    # describe 的参数为 (config, region_id, *args)，返回结果列表
+    # 返回 (合并的结果, 失败的地域列表 [{"RegionId": ..., "Error": ...}])
+    if not region_ids:
+        region_ids = describe_region_ids(config)
+
+    def run(region_id):
+        try:
+            return describe(region_config(config, region_id), region_id, *args), None
+        except Exception as e:
+            return None, str(e)
+
+    items = []
+    errors = []
+    with ThreadPoolExecutor(max_workers=max(1, min(parallel, len(region_ids)))) as executor:
+        for region_id, (res, err) in zip(region_ids, executor.map(run, region_ids)):
+            if err is not None:
+                errors.append({"RegionId": region_id, "Error": err})
+                continue
+            for item in res:
+                item["RegionId"] = region_id
+                items.append(item)
+    return items, errors
+
+
+def describe_all(config: open_api_models.Config, describe, *args, parallel=8):
+    # 命令行使用，失败的地域写到 stderr
+    items, errors = fan_out(config, describe, *args, parallel=parallel)
+    for error in errors:
+        sys.stderr.write(json.dumps(error) + "\n")
+    return items
+
+
+def print_describe(config: open_api_models.Config, region_id, kind, describe, *args, all_regions=False, changes=False, parallel=8, filters=None):
+    # 命令行使用，按参数查询一个或所有地域，输出 json 列表
+    # changes 时输出与上一次快照相比新增、删除和修改的资源（ndjson），filters 为查询的过滤条件，不同的过滤条件分别保存快照
+    if not all_regions:
+        items = describe(config, region_id, *args)
+        if changes:
+            # 与所有地域查询的快照一致，带上 RegionId
+            for item in items:
+                item["RegionId"] = region_id
+            inventory.print_changes(kind, inventory.changes_scope(inventory.config_scope(config, region_id), **(filters or {})), items)
+        else:
+            print(json.dumps(items))
+        return
+    if not changes:
+        print(json.dumps(describe_all(config, describe, *args, parallel=parallel)))
+        return
+    region_ids = describe_region_ids(config)
+    items, errors = fan_out(config, describe, *args, region_ids=region_ids, parallel=parallel)
+    for error in errors:
+        sys.stderr.write(json.dumps(error) + "\n")
+    failed = set(x["RegionId"] for x in errors)
+    for region in region_ids:
+        if region not in failed:
+            scope = inventory.changes_scope(inventory.config_scope(config, region), **(filters or {}))
+            inventory.print_changes(kind, scope, [x for x in items if x["RegionId"] == region])
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+import collections
+import functools
+import random
+import threading
+import time
+
+try:
+    from Tea.exceptions import RetryError
+except ImportError:
+    RetryError = None
+
+
+# OpenAPI 调用共用的重试层
+# 只重试限流、服务端临时错误和网络错误，退避时间为 [0, min(cap, base * 2^i)] 之间的随机值（full jitter）
+# 可以为每个产品设置令牌桶限速，所有调用的次数、重试、限流和等待时间按产品统计
+# 只有查询类接口（Describe*/List*/Get*/Query*）和带 ClientToken 的请求按上面的规则重试
+# 其他接口第一次请求可能已经在服务端生效，重试会重复创建资源，只重试限流和建立连接阶段的失败
+
+
+retryable_codes = {
+    "Throttling", "ServiceUnavailable", "InternalError", "UnknownError", "SDK.HttpError", "SDK.ServerUnreachable",
+    "NetworkError", "ConnectError",
+}
+unsafe_retryable_codes = {"ConnectError"}
+idempotent_prefixes = ("describe", "list", "get", "query")
+# 建立连接阶段的失败，请求没有发到服务端
+connect_error_markers = (
+    "NewConnectionError", "ConnectTimeout", "Connection refused", "Failed to establish a new connection",
+    "NameResolutionError", "Name or service not known", "Temporary failure in name resolution",
+)
+
+policy = {
+    "retry": 3,
+    "base": 0.2,
+    "cap": 10,
+}
+buckets = {}
+metrics = collections.defaultdict(collections.Counter)
+metrics_lock = threading.Lock()
+
+
+class TokenBucket(object):
+    # 每秒生成 rate 个令牌，最多积攒 burst 个，acquire 返回等待的时间
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self.tokens = self.burst
+        self.last = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+def configure(retry=None, base=None, cap=None):
+    for key, val in (("retry", retry), ("base", base), ("cap", cap)):
+        if val is not None:
+            policy[key] = val
+
+
+def set_rate_limit(product, rate, burst=None):
+    # rate 为每秒请求数，rate <= 0 时取消限速
+    if rate and rate > 0:
+        buckets[product] = TokenBucket(rate, burst)
+    else:
+        buckets.pop(product, None)
+
+
+def is_network_error(e):
+    # Tea 把 IOError 转成 RetryError，客户端再包成 inner_exception 为 RetryError 的 UnretryableException
+    for err in (e, getattr(e, "inner_exception", None)):
+        if isinstance(err, OSError) or (RetryError is not None and isinstance(err, RetryError)):
+            return True
+    return False
+
+
+def is_connect_error(e):
+    for err in (e, getattr(e, "inner_exception", None)):
+        if isinstance(err, ConnectionRefusedError):
+            return True
+        if err is not None and any(x in "{} {}".format(type(err).__name__, err) for x in connect_error_markers):
+            return True
+    return False
+
+
+def error_code(e):
+    # aliyunsdkcore 的 ClientException/ServerException 有 get_error_code，Tea SDK 的 TeaException 有 code
+    code = None
+    if hasattr(e, "get_error_code"):
+        code = e.get_error_code()
+    elif getattr(e, "code", None):
+        code = e.code
+    elif is_network_error(e):
+        code = "NetworkError"
+    if code in ("NetworkError", "SDK.HttpError", "SDK.ServerUnreachable") and is_connect_error(e):
+        return "ConnectError"
+    return code
+
+
+def action_name(fn, args):
+    # aliyunsdkcore 的请求有 get_action_name，Tea 客户端的方法名为 snake_case 的接口名
+    for arg in args:
+        if hasattr(arg, "get_action_name"):
+            return arg.get_action_name()
+    return getattr(fn, "__name__", "")
+
+
+def has_client_token(args):
+    for arg in args:
+        if isinstance(arg, dict) and arg.get("ClientToken"):
+            return True
+        if getattr(arg, "client_token", None):
+            return True
+        if hasattr(arg, "get_query_params") and (arg.get_query_params() or {}).get("ClientToken"):
+            return True
+    return False
+
+
+def is_idempotent(action, args):
+    return (action or "").replace("_", "").lower().startswith(idempotent_prefixes) or has_client_token(args)
+
+
+def is_retryable(code, idempotent=True):
+    if code is None:
+        return False
+    if code.startswith("Throttling"):
+        return True
+    return code in (retryable_codes if idempotent else unsafe_retryable_codes)
+
+
+def record(product, **kwargs):
+    with metrics_lock:
+        metrics[product].update(kwargs)
+
+
+def call(product, fn, *args, check=None, action=None, **kwargs):
+    # check 从返回结果中提取错误码，用于接口出错时仍然正常返回的情况（如 POP 接口返回 {"Code": "Throttling.User"}）
+    # action 为接口名，用于判断是否可以安全重试，没有指定时从请求或方法名中获取
+    idempotent = is_idempotent(action or action_name(fn, args), list(args) + list(kwargs.values()))
+    for i in range(policy["retry"] + 1):
+        if product in buckets:
+            record(product, RateLimitWait=buckets[product].acquire())
+        record(product, Calls=1)
+        try:
+            res = fn(*args, **kwargs)
+            code = check(res) if check else None
+        except Exception as e:
+            code = error_code(e)
+            if not is_retryable(code, idempotent) or i == policy["retry"]:
+                record(product, Errors=1)
+                raise
+        else:
+            if not is_retryable(code, idempotent) or i == policy["retry"]:
+                return res
+        record(product, Retries=1, Throttled=1 if code.startswith("Throttling") else 0)
+        time.sleep(random.uniform(0, min(policy["cap"], policy["base"] * 2 ** i)))
+
+
+class RetryClient(object):
+    # 代理 SDK 客户端，所有方法调用都经过 call
+    def __init__(self, product, client):
+        self.product = product
+        self.client = client
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if not callable(attr):
+            return attr
+        return functools.partial(call, self.product, attr)
+
+
+def wrap(product, client):
+    return RetryClient(product, client)
+
+
+def stat():
+    with metrics_lock:
+        return {product: {key: round(val, 3) for key, val in counter.items()} for product, counter in metrics.items()}
@@ -3,86 +3,82 @@
 import argparse
 import json
 import aksk
+import inventory
+import paginate
+import regions
+import retry
 
 from alibabacloud_slb20140515.client import Client as Slb20140515Client
 from alibabacloud_tea_openapi import models as open_api_models
 from alibabacloud_slb20140515 import models as slb_20140515_models
 
 
+def str2bool(v):
+    if isinstance(v, bool):
+        return v
+    if v.lower() in ('yes', 'true', 't', 'y', '1'):
+        return True
+    elif v.lower() in ('no', 'false', 'f', 'n', '0'):
+        return False
+    else:
+        raise argparse.ArgumentTypeError('Boolean value expected.')
+
+
 def describe_load_balancers(config: open_api_models.Config, region_id, load_balancer_id, load_balancer_name):
     req = slb_20140515_models.DescribeLoadBalancersRequest()
     req.region_id = region_id
-    req.page_size = 10
     if load_balancer_name:
         req.load_balancer_name = load_balancer_name
     if load_balancer_id:
         req.load_balancer_id = load_balancer_id
-    balancers = []
-    while True:
-        res = Slb20140515Client(config).describe_load_balancers(req)
-        res = res.to_map()["body"]
-        for balancer in res["LoadBalancers"]["LoadBalancer"]:
-            balancers.append(balancer)
-        if len(balancers) >= res["TotalCount"]:
-            break
-        req.page_number = res["PageNumber"] + 1
-    return balancers
+    client = retry.wrap("slb", Slb20140515Client(config))
+    return paginate.fetch_all(client.describe_load_balancers, req, ["LoadBalancers", "LoadBalancer"], 100)
 
 
 def describe_load_balancer_attribute(config: open_api_models.Config, region_id, load_balancer_id, load_balancer_name):
     if not load_balancer_id:
-        balancers = describe_load_balancers(config, region_id, None, load_balancer_name)
-        for balancer in balancers:
-            if balancer["LoadBalancerName"] == load_balancer_name:
-                load_balancer_id = balancer["LoadBalancerId"]
-                break
+        balancer = inventory.find_one(
+            "slb", inventory.config_scope(config, region_id), lambda: describe_load_balancers(config, region_id, None, None), name=load_balancer_name,
+        )
+        if balancer:
+            load_balancer_id = balancer["LoadBalancerId"]
     req = slb_20140515_models.DescribeLoadBalancerAttributeRequest()
     req.region_id= region_id
     req.load_balancer_id = load_balancer_id
-    res = Slb20140515Client(config).describe_load_balancer_attribute(req)
+    res = retry.wrap("slb", Slb20140515Client(config)).describe_load_balancer_attribute(req)
     return res.to_map()["body"]
 
 
 def describe_access_control_lists(config: open_api_models.Config, region_id):
     req = slb_20140515_models.DescribeAccessControlListsRequest()
     req.region_id = region_id
-    req.page_size = 10
-    acls = []
-    while True:
-        res = Slb20140515Client(config).describe_access_control_lists(req)
-        res = res.to_map()["body"]
-        for acl in res["Acls"]["Acl"]:
-            acls.append(acl)
-        if len(acls) >= res["TotalCount"]:
-            break
-        req.page_number = res["PageNumber"] + 1
-    return acls
+    client = retry.wrap("slb", Slb20140515Client(config))
+    return paginate.fetch_all(client.describe_access_control_lists, req, ["Acls", "Acl"], 50)
+
+
+def get_acl_id(config: open_api_models.Config, region_id, acl_name):
+    acl = inventory.find_one("slb_acl", inventory.config_scope(config, region_id), lambda: describe_access_control_lists(config, region_id), name=acl_name)
+    return acl["AclId"] if acl else None
 
 
 def describe_access_control_list_attribute(config: open_api_models.Config, region_id, acl_id, acl_name):
     if not acl_id:
-        acls = describe_access_control_lists(config, region_id)
-        for acl in acls:
-            if acl["AclName"] == acl_name:
-                acl_id = acl["AclId"]
+        acl_id = get_acl_id(config, region_id, acl_name)
     req = slb_20140515_models.DescribeAccessControlListAttributeRequest()
     req.region_id = region_id
     req.acl_id = acl_id
-    res = Slb20140515Client(config).describe_access_control_list_attribute(req)
+    res = retry.wrap("slb", Slb20140515Client(config)).describe_access_control_list_attribute(req)
     return res.to_map()["body"]
 
 
 def add_access_control_list_entry(config: open_api_models.Config, region_id, acl_id, acl_name, ip):
     if not acl_id:
-        acls = describe_access_control_lists(config, region_id)
-        for acl in acls:
-            if acl["AclName"] == acl_name:
-                acl_id = acl["AclId"]
+        acl_id = get_acl_id(config, region_id, acl_name)
     req = slb_20140515_models.AddAccessControlListEntryRequest()
     req.region_id = region_id
     req.acl_id = acl_id
     req.acl_entrys = json.dumps([{"entry": "{}/32".format(ip), "comment": "auto add by slb.py"}])
-    res = Slb20140515Client(config).add_access_control_list_entry(req)
+    res = retry.wrap("slb", Slb20140515Client(config)).add_access_control_list_entry(req)
     return res.to_map()["body"]
 
 
@@ -91,14 +87,16 @@ def create_load_balancer_tcplistener(config: open_api_models.Config, acl_id, lis
     req.acl_id = acl_id
     req.listener_port = listener_port
     req.backend_server_port = backend_port
-    res = Slb20140515Client(config).create_load_balancer_tcplistener(req)
+    res = retry.wrap("slb", Slb20140515Client(config)).create_load_balancer_tcplistener(req)
     return res.to_map()["body"]
 
 
 def main():
     parser = argparse.ArgumentParser(formatter_class=lambda prog: argparse.RawTextHelpFormatter(prog, width=200), description="""example:
   python3 slb.py -i ak -s sk -r cn-shanghai -a DescribeLoadBalancers
+  python3 slb.py -i ak -s sk -r cn-shanghai -a DescribeLoadBalancers --all-regions --region-parallel 4
   python3 slb.py -i ak -s sk -r cn-shanghai -a DescribeAccessControlLists
+  python3 slb.py -i ak -s sk -r cn-shanghai -a DescribeLoadBalancers --changes
   python3 slb.py -i ak -s sk -r cn-shanghai -a DescribeAccessControlListAttribute --acl-name weboffice
   python3 slb.py -i ak -s sk -r cn-shanghai -a DescribeAccessControlListAttribute --acl-id acl-uf6oj1uhti7tf2wd3qdtg
   python3 slb.py -i ak -s sk -r cn-shanghai -a AddAccessControlListEntry --acl-name weboffice --ip "$(wget -qO - icanhazip.com)"
@@ -119,7 +117,13 @@ def main():
         "DescribeLoadBalancerAttribute", "DescribeLoadBalancers", "DescribeAccessControlLists", "DescribeAccessControlListAttribute",
         "AddAccessControlListEntry", "CreateLoadBalancerTCPListener"
     ])
+    parser.add_argument("--all-regions", nargs="?", const=True, default=False, type=str2bool, help="describe in all regions concurrently, region id is set in each result")
+    parser.add_argument("--region-parallel", type=int, default=8, help="max regions described concurrently")
+    parser.add_argument("--changes", nargs="?", const=True, default=False, type=str2bool, help="print added/removed/modified resources since last run as ndjson")
+    parser.add_argument("--inventory", default="~/.alics/inventory.db", help="local resource index for name lookups, disabled if empty")
+    parser.add_argument("--inventory-ttl", type=int, default=600, help="resync resource index after seconds")
     args = parser.parse_args()
+    inventory.configure(filename=args.inventory, ttl=args.inventory_ttl)
     if args.credential:
         args.access_key_id, args.access_key_secret = aksk.load_from_file(args.credential)
     config = open_api_models.Config(
@@ -129,11 +133,14 @@ def main():
     )
 
     if args.action == "DescribeLoadBalancers":
-        print(json.dumps(describe_load_balancers(config, args.region_id, args.load_balancer_id, args.load_balancer_name)))
+        regions.print_describe(
+            config, args.region_id, "slb", describe_load_balancers, args.load_balancer_id, args.load_balancer_name,
+            all_regions=args.all_regions, changes=args.changes, parallel=args.region_parallel, filters={"LoadBalancerId": args.load_balancer_id, "LoadBalancerName": args.load_balancer_name},
+        )
     elif args.action == "DescribeLoadBalancerAttribute":
         print(json.dumps(describe_load_balancer_attribute(config, args.region_id, args.load_balancer_id, args.load_balancer_name)))
     elif args.action == "DescribeAccessControlLists":
-        print(json.dumps(describe_access_control_lists(config, args.region_id)))
+        regions.print_describe(config, args.region_id, "slb_acl", describe_access_control_lists, all_regions=args.all_regions, changes=args.changes, parallel=args.region_parallel)
     elif args.action == "DescribeAccessControlListAttribute":
         print(json.dumps(describe_access_control_list_attribute(config, args.region_id, args.acl_id, args.acl_name)))
     elif args.action == "AddAccessControlListEntry":
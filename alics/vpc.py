@@ -3,6 +3,10 @@
 import argparse
 import json
 import aksk
+import inventory
+import paginate
+import regions
+import retry
 
 
 from alibabacloud_vpc20160428.client import Client as Vpc20160428Client
@@ -10,6 +14,17 @@ from alibabacloud_tea_openapi import models as open_api_models
 from alibabacloud_vpc20160428 import models as vpc_20160428_models
 
 
+def str2bool(v):
+    if isinstance(v, bool):
+        return v
+    if v.lower() in ('yes', 'true', 't', 'y', '1'):
+        return True
+    elif v.lower() in ('no', 'false', 'f', 'n', '0'):
+        return False
+    else:
+        raise argparse.ArgumentTypeError('Boolean value expected.')
+
+
 def create_vpc(config: open_api_models.Config, region_id, vpc_name, cidr_block, description):
     res = describe_vpcs(config, region_id, None, vpc_name)
     if len(res) != 0:
@@ -19,7 +34,7 @@ def create_vpc(config: open_api_models.Config, region_id, vpc_name, cidr_block,
     req.cidr_block = cidr_block
     req.vpc_name = vpc_name
     req.description = description
-    res = Vpc20160428Client(config).create_vpc(req)
+    res = retry.wrap("vpc", Vpc20160428Client(config)).create_vpc(req)
     return res.to_map()["body"]
 
 
@@ -30,16 +45,13 @@ def describe_vpcs(config: open_api_models.Config, region_id, vpc_id, vpc_name):
         req.vpc_id = vpc_id
     if vpc_name:
         req.vpc_name = vpc_name
-    vpcs = []
-    while True:
-        res = Vpc20160428Client(config).describe_vpcs(req)
-        res = res.to_map()["body"]
-        for vpc in res["Vpcs"]["Vpc"]:
-            vpcs.append(vpc)
-        if len(vpcs) >= res["TotalCount"]:
-            break
-        req.page_number = res["PageNumber"] + 1
-    return vpcs
+    client = retry.wrap("vpc", Vpc20160428Client(config))
+    return paginate.fetch_all(client.describe_vpcs, req, ["Vpcs", "Vpc"], 50)
+
+
+def get_vpc_id(config: open_api_models.Config, region_id, vpc_name):
+    # 没有找到时与 describe_vpcs(...)[0] 一样抛出 IndexError
+    return inventory.find("vpc", inventory.config_scope(config, region_id), lambda: describe_vpcs(config, region_id, None, None), name=vpc_name)[0]["VpcId"]
 
 
 def describe_vswitches(config: open_api_models.Config, region_id, vpc_id, vpc_name, vswitch_name):
@@ -48,9 +60,8 @@ def describe_vswitches(config: open_api_models.Config, region_id, vpc_id, vpc_na
     if vpc_id:
         req.vpc_id = vpc_id
     if not vpc_id and vpc_name:
-        res = describe_vpcs(config, region_id, None, vpc_name)
-        req.vpc_id = res[0]["VpcId"]
-    res = Vpc20160428Client(config).describe_vswitches(req)
+        req.vpc_id = get_vpc_id(config, region_id, vpc_name)
+    res = retry.wrap("vpc", Vpc20160428Client(config)).describe_vswitches(req)
     res = res.to_map()["body"]["VSwitches"]["VSwitch"]
     if vswitch_name:
         return [x for x in res if x["VSwitchName"].startswith(vswitch_name)]
@@ -61,6 +72,8 @@ def main():
     parser = argparse.ArgumentParser(formatter_class=lambda prog: argparse.RawTextHelpFormatter(prog, width=200), description="""example:
   python3 vpc.py -i ak -s sk -r cn-shanghai -a CreateVpc --cidr-block "10.0.0.0/8" --vpc-name imm-dev-hl-vpc-bc
   python3 vpc.py -i ak -s sk -r cn-shanghai -a DescribeVpcs --vpc-name imm-dev-hl-vpc-shanghai-ecs
+  python3 vpc.py -i ak -s sk -r cn-shanghai -a DescribeVpcs --all-regions
+  python3 vpc.py -i ak -s sk -r cn-shanghai -a DescribeVSwitches --changes
 """)
     parser.add_argument("-i", "--access-key-id", help="access key id")
     parser.add_argument("-s", "--access-key-secret", help="access key secret")
@@ -74,7 +87,13 @@ def main():
     parser.add_argument("-a", "--action", help="action", choices=[
         "CreateVpc", "DescribeVpcs", "DescribeVSwitches"
     ])
+    parser.add_argument("--all-regions", nargs="?", const=True, default=False, type=str2bool, help="describe in all regions concurrently, region id is set in each result")
+    parser.add_argument("--region-parallel", type=int, default=8, help="max regions described concurrently")
+    parser.add_argument("--changes", nargs="?", const=True, default=False, type=str2bool, help="print added/removed/modified resources since last run as ndjson")
+    parser.add_argument("--inventory", default="~/.alics/inventory.db", help="local resource index for name lookups, disabled if empty")
+    parser.add_argument("--inventory-ttl", type=int, default=600, help="resync resource index after seconds")
     args = parser.parse_args()
+    inventory.configure(filename=args.inventory, ttl=args.inventory_ttl)
     if args.credential:
         args.access_key_id, args.access_key_secret = aksk.load_from_file(args.credential)
     config = open_api_models.Config(
@@ -85,9 +104,15 @@ def main():
     if args.action == "CreateVpc":
         print(json.dumps(create_vpc(config, args.region_id, args.vpc_name, args.cidr_block, args.description)))
     elif args.action == "DescribeVpcs":
-        print(json.dumps(describe_vpcs(config, args.region_id, args.vpc_id, args.vpc_name)))
+        regions.print_describe(
+            config, args.region_id, "vpc", describe_vpcs, args.vpc_id, args.vpc_name,
+            all_regions=args.all_regions, changes=args.changes, parallel=args.region_parallel, filters={"VpcId": args.vpc_id, "VpcName": args.vpc_name},
+        )
     elif args.action == "DescribeVSwitches":
-        print(json.dumps(describe_vswitches(config, args.region_id, args.vpc_id, args.vpc_name, args.vswitch_name)))
+        regions.print_describe(
+            config, args.region_id, "vswitch", describe_vswitches, args.vpc_id, args.vpc_name, args.vswitch_name,
+            all_regions=args.all_regions, changes=args.changes, parallel=args.region_parallel, filters={"VpcId": args.vpc_id, "VpcName": args.vpc_name, "VSwitchName": args.vswitch_name},
+        )
     else:
         parser.print_help()
 